@@ -0,0 +1,227 @@
+"""
+Caches for FFLogs responses
+
+EventCache keeps raw responses on disk, stored gzip compressed under a name
+derived from the report code, the fight and a hash of the query and its
+variables, so the same request for a finished fight is only ever sent to
+FFLogs once. When the cache grows past max_bytes the least recently used
+responses are removed
+
+MetadataCache keeps report metadata in memory for a limited time
+"""
+
+from collections import OrderedDict
+import gzip
+from hashlib import sha256
+import json
+import os
+import tempfile
+from threading import Lock
+import time
+
+CACHE_SUFFIX = '.json.gz'
+
+
+# hash of a query and its variables which doesn't depend on key order
+def query_hash(query, variables):
+    return sha256(json.dumps([query, variables], sort_keys=True).encode()).hexdigest()
+
+
+class EventCache:
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        # the size is tracked as entries are added and recounted from the
+        # directory whenever entries are evicted since other processes may
+        # share the same directory
+        self.size = sum([size for (_, _, size) in self._entries()])
+
+    def _path(self, report, fight, key):
+        name = sha256('{}/{}/{}'.format(report, fight, key).encode()).hexdigest()
+        return os.path.join(self.directory, name + CACHE_SUFFIX)
+
+    # (modified time, path, size) of every cached response
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    # returns the cached response or None, reading a response marks it as
+    # recently used
+    def get(self, report, fight, key):
+        path = self._path(report, fight, key)
+        try:
+            with gzip.open(path, 'rt') as cache_file:
+                data = json.load(cache_file)
+        except (OSError, EOFError, ValueError):
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, report, fight, key, data):
+        payload = gzip.compress(json.dumps(data).encode())
+        path = self._path(report, fight, key)
+
+        (handle, temp_path) = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as cache_file:
+                cache_file.write(payload)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self._added(len(payload))
+
+    def _added(self, size):
+        with self._lock:
+            self.size += size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    # returns the cached response as an iterator of text chunks (or None if
+    # it isn't cached) so it can be parsed without reading it all at once
+    def read_chunks(self, report, fight, key, chunk_size=64 * 1024):
+        path = self._path(report, fight, key)
+        try:
+            cache_file = gzip.open(path, 'rt')
+        except OSError:
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        def read():
+            with cache_file:
+                while True:
+                    chunk = cache_file.read(chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return read()
+
+    # returns a writer which stores a response written to it in chunks once
+    # it's committed
+    def writer(self, report, fight, key):
+        return CacheWriter(self, self._path(report, fight, key))
+
+    # removes the least recently used responses until the cache is back
+    # under 90% of max_bytes so eviction isn't needed on every put
+    def _evict(self):
+        entries = sorted(self._entries())
+        self.size = sum([size for (_, _, size) in entries])
+
+        for (_, path, size) in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+
+class CacheWriter:
+    def __init__(self, cache: EventCache, path):
+        self.cache = cache
+        self.path = path
+        self.temp_path = None
+        self.raw_file = None
+        self.file = None
+
+    # starts (or restarts) writing the response
+    def start(self):
+        self.discard()
+        (handle, self.temp_path) = tempfile.mkstemp(dir=self.cache.directory)
+        self.raw_file = os.fdopen(handle, 'wb')
+        self.file = gzip.open(self.raw_file, 'wt')
+
+    def write(self, text):
+        self.file.write(text)
+
+    def _close(self):
+        if self.file is not None:
+            # closing the gzip file doesn't close the file it writes to
+            self.file.close()
+            self.raw_file.close()
+            self.file = None
+            self.raw_file = None
+
+    def commit(self):
+        self._close()
+        try:
+            size = os.path.getsize(self.temp_path)
+            os.replace(self.temp_path, self.path)
+        except OSError:
+            self.discard()
+            return
+        self.temp_path = None
+        self.cache._added(size)
+
+    def discard(self):
+        self._close()
+        if self.temp_path is not None:
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+            self.temp_path = None
+
+
+"""
+In-process cache of report metadata (the fight list and actors) where each
+entry expires after its own time to live and the least recently used entry
+is dropped once max_entries are held
+"""
+
+
+class MetadataCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            (expires, value) = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # removes the entry for key, returning whether there was one
+    def discard(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -21,12 +21,16 @@
 # """
 
 
+from collections import defaultdict, deque
 from datetime import timedelta
 import os
+import numpy as np
 import pandas as pd
-from cardcalc_data import Player, Pet, CardPlay, DrawWindow, FightInfo, BurstDamageCollection, CardCalcException, ActorList, SearchWindow
-from cardcalc_fflogsapi import get_card_draw_events, get_card_play_events, get_actor_lists, get_fight_info, get_damage_events
-from cardcalc_damage import calc_snapshot_damage, compute_total_damage, search_burst_window, compute_remove_card_damage, cleanup_hit_data, cleanup_prepare_events
+from cardcalc_data import Player, Pet, CardPlay, CardPlayIndex, DrawWindow, FightInfo, BurstDamageCollection, CardCalcException, ActorList, SearchWindow
+from cardcalc_fflogsapi import get_fight_data, get_report_data, get_report_fights
+from cardcalc_parallel import WorkerPool, evaluate_parallel
+from cardcalc_ratelimit import BATCH_PRIORITY, request_priority
+from cardcalc_damage import calc_snapshot_damage, compute_total_damage, search_burst_timeline, compute_remove_card_damage, cleanup_hit_data, cleanup_prepare_events
 
 
 def _handle_draw_events(card_events, start_time, end_time):
@@ -34,6 +38,11 @@ def _handle_draw_events(card_events, start_time, end_time):
     active_window = DrawWindow(start=start_time, castId=0)
     draw_windows = []
 
+    # closed draw windows indexed by (source, start) and (source, end) so
+    # events can find the window they belong to without scanning them all
+    draws_by_start = defaultdict(list)
+    draws_by_end = defaultdict(list)
+
     # each event is handled by checking if it's a buff or a cast, searching to check if the same timestamp is already in the list or the active window
     # if so then update that and continue
     # otherwise
@@ -58,14 +67,17 @@ def _handle_draw_events(card_events, start_time, end_time):
                     active_window.endId)
                 # print("Closing CAST at {}".format(str(timedelta(milliseconds=(event['timestamp']-start_time)))[2:11]))
                 draw_windows.append(active_window)
+                draws_by_start[(active_window.source, active_window.start)].append(
+                    active_window)
+                draws_by_end[(active_window.source, active_window.end)].append(
+                    active_window)
                 active_window = DrawWindow(
                     start=event['timestamp'], source=event['sourceID'], castId=event['abilityGameID'])
 
             # search for previously closed windows that end at this timestamp
             # and thus are missing a proper end cast
-            end_set = [draw
-                       for draw in draw_windows
-                       if draw.source == event['sourceID'] and draw.end == event['timestamp']]
+            end_set = draws_by_end.get(
+                (event['sourceID'], event['timestamp']), [])
 
             if end_set:
                 draw_end = end_set[0]
@@ -75,8 +87,8 @@ def _handle_draw_events(card_events, start_time, end_time):
 
             # search for previously handled buff windows without a cast
             draw_set = [draw
-                        for draw in draw_windows
-                        if draw.source == event['sourceID'] and draw.start == event['timestamp'] and draw.castId == 0]
+                        for draw in draws_by_start.get((event['sourceID'], event['timestamp']), [])
+                        if draw.castId == 0]
             # if one is found then update it
             if draw_set:
                 draw = draw_set[0]
@@ -93,8 +105,8 @@ def _handle_draw_events(card_events, start_time, end_time):
 
             # search for previously handled draw windows without an attached buff and update them
             draw_set = [draw
-                        for draw in draw_windows
-                        if draw.source == event['sourceID'] and draw.start == event['timestamp'] and draw.buffId == 0]
+                        for draw in draws_by_start.get((event['sourceID'], event['timestamp']), [])
+                        if draw.buffId == 0]
             # if one is found then update it
             if draw_set:
                 draw = draw_set[0]
@@ -114,69 +126,83 @@ def _handle_draw_events(card_events, start_time, end_time):
     return draw_windows
 
 
+# adds a card to the list of cards and queues it up to be matched with later
+# buff applications/removals for the same (target, source, buffId)
+
+
+def _add_card_play(card, cards, awaiting_start, awaiting_end):
+    cards.append(card)
+
+    key = (card.target, card.source, card.buffId)
+    if card.start is None:
+        awaiting_start[key].append(card)
+    if card.end is None:
+        awaiting_end[key].append(card)
+
+
 def _handle_play_events(card_events, start_time, end_time):
     cards = []
 
+    # cards still missing a start or end for each (target, source, buffId)
+    # kept in the order they were added so the first match is always at the
+    # front of the queue
+    awaiting_start = defaultdict(deque)
+    awaiting_end = defaultdict(deque)
+
     # Build list from events
     for event in card_events:
+        key = (event['targetID'], event['sourceID'], event['abilityGameID'])
+
         # if the event is the cast for a play then add to the list
         if event['type'] == 'cast':
-            cards.append(CardPlay(cast=event['timestamp'], source=event['sourceID'],
-                         target=event['targetID'], castId=event['abilityGameID'], start=None, end=None))
+            _add_card_play(CardPlay(cast=event['timestamp'], source=event['sourceID'],
+                                    target=event['targetID'], castId=event['abilityGameID'], start=None, end=None),
+                           cards, awaiting_start, awaiting_end)
         # If applying a buff then try and find a matching card play cast and add the new data to that, otherwise make a new item
         elif event['type'] == 'applybuff':
             # TODO: I could potentially check that the buff start is close to the cast event but that shouldn't actually be required
-            card_set = [card
-                        for card in cards
-                        if card.target == event['targetID'] and card.source == event['sourceID'] and card.buffId == event['abilityGameID'] and card.start is None]
-            if card_set:
-                card = card_set[0]
+            if awaiting_start[key]:
+                card = awaiting_start[key].popleft()
                 card.start = event['timestamp']
             else:
                 # if there is no associated cast event then use the buff time as the cast time
-                cards.append(CardPlay(cast=event['timestamp'], start=event['timestamp'], end=None,
-                             source=event['sourceID'], target=event['targetID'], buffId=event['abilityGameID']))
+                _add_card_play(CardPlay(cast=event['timestamp'], start=event['timestamp'], end=None,
+                                        source=event['sourceID'], target=event['targetID'], buffId=event['abilityGameID']),
+                               cards, awaiting_start, awaiting_end)
         # If removing the buff, add an end timestamp to the matching application
         # TODO: need to check for overwritten cards to both warn about these and properly calculate the damage separately for what could have been covered by the full 15s window
         elif event['type'] == 'removebuff':
-            card_set = [card
-                        for card in cards
-                        if card.target == event['targetID'] and card.source == event['sourceID'] and card.buffId == event['abilityGameID'] and card.end is None]
             # add it to the discovered card play
-            if card_set:
-                card = card_set[0]
+            if awaiting_end[key]:
+                card = awaiting_end[key].popleft()
                 card.end = event['timestamp']
             # if there is no start event, add one and set it to 15s prior
             else:
-                cards.append(CardPlay(cast=max(event['timestamp'] - 15000, start_time), start=max(event['timestamp'] - 15000, start_time),
-                             end=event['timestamp'], source=event['sourceID'], target=event['targetID'], buffId=event['abilityGameID']))
+                _add_card_play(CardPlay(cast=max(event['timestamp'] - 15000, start_time), start=max(event['timestamp'] - 15000, start_time),
+                                        end=event['timestamp'], source=event['sourceID'], target=event['targetID'], buffId=event['abilityGameID']),
+                               cards, awaiting_start, awaiting_end)
         # special case for refresh buff which is treated like both apply and remove at the same time
         elif event['type'] == 'refreshbuff':
             # TODO: need to cleanup div/sleeve handling here as it's obsolete
             # first clean up the sleeve/divend event
-            card_set = [card
-                        for card in cards
-                        if card.target == event['targetID'] and card.source == event['sourceID'] and card.buffId == event['abilityGameID'] and card.end is None]
-            # add it to the discovered card play
-            if card_set:
-                card = card_set[0]
+            if awaiting_end[key]:
+                card = awaiting_end[key].popleft()
                 card.end = event['timestamp']
             # if there is no start event, add one and set it to 15s prior
             else:
-                cards.append(CardPlay(cast=max(event['timestamp'] - 15000, start_time), start=max(event['timestamp'] - 15000, start_time),
-                             end=event['timestamp'], source=event['sourceID'], target=event['targetID'], buffId=event['abilityGameID']))
+                _add_card_play(CardPlay(cast=max(event['timestamp'] - 15000, start_time), start=max(event['timestamp'] - 15000, start_time),
+                                        end=event['timestamp'], source=event['sourceID'], target=event['targetID'], buffId=event['abilityGameID']),
+                               cards, awaiting_start, awaiting_end)
 
             # now we can do the same for the buff window following the refresh
-            card_set = [card
-                        for card in cards
-                        if card.target == event['targetID'] and card.source == event['sourceID'] and card.buffId == event['abilityGameID'] and card.start is None]
-            if card_set:
-                card = card_set[0]
+            if awaiting_start[key]:
+                card = awaiting_start[key].popleft()
                 card.start = event['timestamp']
             else:
                 # if there is no associated cast event then use the buff time as the cast time
-                cards.append(CardPlay(cast=event['timestamp'], start=event['timestamp'], end=None,
-                             source=event['sourceID'], target=event['targetID'], buffId=event['abilityGameID']))
+                _add_card_play(CardPlay(cast=event['timestamp'], start=event['timestamp'], end=None,
+                                        source=event['sourceID'], target=event['targetID'], buffId=event['abilityGameID']),
+                               cards, awaiting_start, awaiting_end)
 
     # this might be the wrong thing but for now I'm gonna toss cards with cast events but no buff events
     valid_cards = [card
@@ -249,7 +275,7 @@ def _clean_up_cards(cards, actors):
     return new_cards
 
 
-def _handle_card_play(card, cards, damage_report, actors, fight_info):
+def _handle_card_play(card, card_index: CardPlayIndex, damage_report, actors, fight_info):
     if card is None:
         return {
             'cardPlayTime': 0,
@@ -300,21 +326,16 @@ def _handle_card_play(card, cards, damage_report, actors, fight_info):
 
         # adjust the damage for incorrect roles
         corrected_damage = []
-        active_cards = [prev_card for prev_card in cards
-                        if prev_card.start < card.start
-                        and prev_card.end > card.start]
-
         for pid, dmg in damages.items():
             mod_dmg = dmg
             has_card = False
             has_card_remaining = 0
 
-            for prev_card in active_cards:
-                if prev_card.start < card.start and prev_card.end > card.start and prev_card.target == pid:
-                    has_card = True
-                    # this doesn't check for early cutoffs that would occur from
-                    # playing another card on someone before the first one ends
-                    has_card_remaining = prev_card.end - card.start
+            for prev_card in card_index.active_at(card.start, pid):
+                has_card = True
+                # this doesn't check for early cutoffs that would occur from
+                # playing another card on someone before the first one ends
+                has_card_remaining = prev_card.end - card.start
 
             if card.role != actors.players[pid].role:
                 mod_dmg = int(dmg/2)
@@ -361,15 +382,9 @@ def _handle_card_play(card, cards, damage_report, actors, fight_info):
         }
 
 
-def _get_active_card(cards, draw):
-    active_cards = []
-    for c in cards:
-        # check if the card was played during the draw window
-        if c.cast > draw.start and c.cast <= draw.end:
-            active_cards.append(c)
-        if c.cast > draw.end:
-            break
-    return active_cards
+def _get_active_card(card_index: CardPlayIndex, draw):
+    # check if the card was played during the draw window
+    return card_index.cast_between(draw.start, draw.end)
 
 
 def _handle_draw_play_damage(draw_window_damage_collection, draw_window_duration, fight_info, actors) -> tuple[pd.DataFrame, pd.DataFrame]:
@@ -387,90 +402,31 @@ def _handle_draw_play_damage(draw_window_damage_collection, draw_window_duration
     else:
         data_count = 8
 
-    sorted_damage_list = pd.DataFrame((draw_window_damage_collection.df.unstack(
-    ).to_dict().items()), columns=['combined', 'damage'])
-
-    sorted_damage_list['id'] = sorted_damage_list['combined'].apply(
-        lambda row: row[0])
-    sorted_damage_list['timestamp'] = sorted_damage_list['combined'].apply(
-        lambda row: row[1])
-    sorted_damage_list.drop(columns=['combined'], inplace=True)
-    sorted_damage_list.sort_values(by='damage', inplace=True, ascending=False)
-
-    # separate out the ranged and melee instances
-    sorted_damage_list['role'] = sorted_damage_list['id'].apply(
-        lambda row: actors.players[row].role)
-
-    melee_damage_list = sorted_damage_list.loc[lambda df: (
-        df['role'] == 'melee')]
-    ranged_damage_list = sorted_damage_list.loc[lambda df:(
-        df['role'] == 'ranged')]
-
-    collected_count = 0
-    examined_count = 0
-
-    while collected_count < data_count and examined_count < melee_damage_list['id'].size:
-        # get the next lowest damage instance
-        # current_item = melee_damage_list.iloc[examined_count]
-
-        target_opt = melee_damage_list['id'].iloc[examined_count]
-        time_opt = melee_damage_list['timestamp'].iloc[examined_count]
-        damage_opt = melee_damage_list['damage'].iloc[examined_count]
-        # ) = (current_item[0][0], current_item[0][1], current_item[1])
-
-        examined_count += 1
-
-        # check if the new entry we've selected is in a window of 4s as an entry from that player with higher damage
-        ignore_entry = False
-        for table_entry in melee_draw_damage:
-            if target_opt == table_entry['id'] and abs(time_opt - table_entry['timestamp']) < 4000:
-                ignore_entry = True
-
-        if ignore_entry:
-            continue
-
-        # if the max damage is greater than 0 then add an entry:
-        if damage_opt > 0:
-            collected_count += 1
-            melee_draw_damage.append({
-                'count': collected_count,
-                'id': target_opt,
-                'damage': damage_opt,
-                'timestamp': time_opt,
-                'time': fight_info.ToString(time=int(time_opt))[:5],
-            })
-
-    collected_count = 0
-    examined_count = 0
-
-    while collected_count < data_count and examined_count < ranged_damage_list['id'].size:
-        # get the next lowest damage instance
-        target_opt = ranged_damage_list['id'].iloc[examined_count]
-        time_opt = ranged_damage_list['timestamp'].iloc[examined_count]
-        damage_opt = ranged_damage_list['damage'].iloc[examined_count]
-
-        examined_count += 1
-        # (target_opt, time_opt, damage_opt) = (current_item[0][0], current_item[0][1], current_item[1])
-
-        # check if the new entry we've selected is in a window of 4s as an entry from that player with higher damage
-        ignore_entry = False
-        for table_entry in ranged_draw_damage:
-            if target_opt == table_entry['id'] and abs(time_opt - table_entry['timestamp']) < 4000:
-                ignore_entry = True
-
-        if ignore_entry:
-            continue
-
-        # if the max damage is greater than 0 then add an entry:
-        if damage_opt > 0:
-            collected_count += 1
-            ranged_draw_damage.append({
-                'count': collected_count,
-                'id': target_opt,
-                'damage': damage_opt,
-                'timestamp': time_opt,
-                'time': fight_info.ToString(time=int(time_opt))[:5],
-            })
+    # separate out the ranged and melee players and collect their highest
+    # damage windows, ignoring any window within 4s of a higher damage
+    # window from the same player
+    melee_ids = [pid for pid in draw_window_damage_collection.ids
+                 if actors.players[pid].role == 'melee']
+    ranged_ids = [pid for pid in draw_window_damage_collection.ids
+                  if actors.players[pid].role == 'ranged']
+
+    for (time_opt, target_opt, damage_opt) in draw_window_damage_collection.get_top(melee_ids, data_count, 4000):
+        melee_draw_damage.append({
+            'count': len(melee_draw_damage) + 1,
+            'id': target_opt,
+            'damage': damage_opt,
+            'timestamp': time_opt,
+            'time': fight_info.ToString(time=time_opt)[:5],
+        })
+
+    for (time_opt, target_opt, damage_opt) in draw_window_damage_collection.get_top(ranged_ids, data_count, 4000):
+        ranged_draw_damage.append({
+            'count': len(ranged_draw_damage) + 1,
+            'id': target_opt,
+            'damage': damage_opt,
+            'timestamp': time_opt,
+            'time': fight_info.ToString(time=time_opt)[:5],
+        })
 
     melee_draw_damage_table = pd.DataFrame(melee_draw_damage)
 
@@ -489,26 +445,175 @@ def _handle_draw_play_damage(draw_window_damage_collection, draw_window_duration
     return (melee_draw_damage_table, ranged_draw_damage_table)
 
 
-def cardcalc(report, fight_id, token) -> FightInfo:
+def _evaluate_draw_window(count, draw, card_index, damage_report, fight_damage_collection, actors, fight_info):
+    # find if there was a card played in this window
+    active_cards = _get_active_card(card_index, draw)
+    # for now we toss out other active cards
+    card = active_cards[0] if len(active_cards) > 0 else None
+
+    # only handle the play window if there was a card played
+    card_play_data = _handle_card_play(
+        card, card_index, damage_report, actors, fight_info)
+
+    # now we can begin compiling data for the draw window as a whole
+    card_draw_data = {}
+
+    # burst damage for the possible card plays during the draw window
+    draw_window_damage_collection = fight_damage_collection.window(
+        draw.start, draw.end)
+
+    draw_window_duration = timedelta(
+        milliseconds=(draw.end-draw.start)).total_seconds()
+
+    (melee_draw_damage_table, ranged_draw_damage_table) = _handle_draw_play_damage(
+        draw_window_damage_collection, draw_window_duration, fight_info, actors)
+
+    if not ranged_draw_damage_table.empty:
+        draw_optimal_time_ranged = fight_info.ToString(
+            time=int(ranged_draw_damage_table['timestamp'].iloc[0]))[:5]
+        draw_optimal_target_ranged = actors.players[ranged_draw_damage_table['id'].iloc[0]].name
+        draw_optimal_damage_ranged = int(
+            ranged_draw_damage_table['damage'].iloc[0])
+    else:
+        draw_optimal_time_ranged = 'None'
+        draw_optimal_target_ranged = 'None'
+        draw_optimal_damage_ranged = 0
+
+    if not melee_draw_damage_table.empty:
+        draw_optimal_time_melee = fight_info.ToString(
+            time=int(melee_draw_damage_table['timestamp'].iloc[0]))[:5]
+        draw_optimal_target_melee = actors.players[melee_draw_damage_table['id'].iloc[0]].name
+        draw_optimal_damage_melee = int(
+            melee_draw_damage_table['damage'].iloc[0])
+    else:
+        draw_optimal_time_melee = 'None'
+        draw_optimal_target_melee = 'None'
+        draw_optimal_damage_melee = 0
+
+    card_draw_data = {
+        'startTime': fight_info.ToString(time=draw.start)[:5],
+        'endTime': fight_info.ToString(time=draw.end)[:5],
+        'startEvent': draw.startEvent,
+        'endEvent': draw.endEvent,
+        'startId': int(draw.startId),
+        'endId': int(draw.endId),
+        'drawDamageTableMelee': melee_draw_damage_table.to_dict(orient='records'),
+        'drawDamageTableRanged': ranged_draw_damage_table.to_dict(orient='records'),
+        'drawOptimalTimeRanged': draw_optimal_time_ranged,
+        'drawOptimalTargetRanged': draw_optimal_target_ranged,
+        'drawOptimalDamageRanged': draw_optimal_damage_ranged,
+        'drawOptimalTimeMelee': draw_optimal_time_melee,
+        'drawOptimalTargetMelee': draw_optimal_target_melee,
+        'drawOptimalDamageMelee': draw_optimal_damage_melee,
+        'count': count,
+    }
+
+    # finally combine the two sets of data for the draw window/card play
+    return card_draw_data | card_play_data
+
+
+# builds what every draw window needs from the arrays shared by cardcalc,
+# once per fight in each worker process
+
+
+def _prepare_shared_fight(arrays, context):
+    (hit_types, burst_ids, burst_duration, cards, actors, fight_info) = context
+
+    damage_report = pd.DataFrame({
+        'timestamp': arrays['timestamp'],
+        'sourceID': arrays['sourceID'],
+        'amount': arrays['amount'],
+        'hitType': pd.Categorical.from_codes(arrays['hitType'], categories=hit_types),
+    }, copy=False)
+    fight_damage_collection = BurstDamageCollection(
+        arrays['burstDamage'], arrays['burstTimestamps'], burst_ids, burst_duration)
+
+    return (CardPlayIndex(cards), damage_report, fight_damage_collection, actors, fight_info)
+
+
+# runs _evaluate_draw_window in a worker process with what
+# _prepare_shared_fight built
+
+
+def _evaluate_shared_draw_window(count, draw, arrays, context):
+    (card_index, damage_report, fight_damage_collection, actors, fight_info) = context
+
+    return _evaluate_draw_window(count, draw, card_index, damage_report, fight_damage_collection, actors, fight_info)
+
+
+def cardcalc(report, fight_id, token, workers=None) -> FightInfo:
     """
     Reads an FFLogs report and solves for optimal Card Usage
+
+    If workers is more than 1 the draw windows are evaluated across that
+    many worker processes
     """
-    # get fight info
-    fight_info = get_fight_info(report, fight_id, token)
+    # get the fight info, actors, card, draw and damage events
+    (fight_info, actors, card_events, draw_events,
+     damage_events) = get_fight_data(report, fight_id, token)
 
-    # get actors
-    actors = get_actor_lists(fight_info, token)
+    return _cardcalc_fight(fight_info, actors, card_events, draw_events, damage_events, workers)
 
-    # Build the list of card plays and draw windows
-    card_events = get_card_play_events(fight_info, token)
-    draw_events = get_card_draw_events(fight_info, token)
 
+# number of fights whose events are fetched together when solving a report
+REPORT_GROUP_SIZE = 4
+
+
+def cardcalc_report(report, token, workers=None, skip=()):
+    """
+    Reads every fight in an FFLogs report and solves for optimal Card Usage
+    in each of them
+
+    Returns a dictionary of fight id to the same results as cardcalc, fights
+    which can't be solved (e.g. no cards were played) are left out
+    """
+    return dict(iter_cardcalc_report(report, token, workers, skip))
+
+
+def iter_cardcalc_report(report, token, workers=None, skip=(), group_size=REPORT_GROUP_SIZE):
+    """
+    Solves for optimal Card Usage in every fight of an FFLogs report other
+    than the fight ids in skip, yielding (fight id, results) as each fight
+    is solved
+
+    The report data and events are fetched for group_size fights at a time
+    so only one group of fights is held in memory at once
+    """
+    # a whole report is a batch job so interactive requests go first, the
+    # priority carries over to the threads the requests are made from
+    with request_priority(BATCH_PRIORITY):
+        fights = sorted(get_report_fights(report, token), key=lambda f: f.start)
+    if not fights:
+        raise CardCalcException("No fights found in report")
+    fight_ids = [f.index for f in fights if f.index not in skip]
+
+    # the worker processes are started once and reused for every fight
+    pool = WorkerPool(workers) if workers is not None and workers > 1 else None
+
+    try:
+        for group in range(0, len(fight_ids), group_size):
+            with request_priority(BATCH_PRIORITY):
+                (group_fights, actor_lists, fight_events) = get_report_data(
+                    report, token, fight_ids[group:group + group_size])
+
+            for fight_info in group_fights:
+                (card_events, draw_events,
+                 damage_events) = fight_events.pop(fight_info.index)
+                try:
+                    yield fight_info.index, _cardcalc_fight(
+                        fight_info, actor_lists[fight_info.index], card_events, draw_events, damage_events, workers, pool)
+                except CardCalcException:
+                    continue
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def _cardcalc_fight(fight_info, actors, card_events, draw_events, damage_events, workers=None, pool=None):
+    # Build the list of card plays and draw windows
     cards = _handle_play_events(card_events, fight_info.start, fight_info.end)
     draws = _handle_draw_events(draw_events, fight_info.start, fight_info.end)
 
-    # Get all damage events
-    damage_events = get_damage_events(fight_info, token)
-
     # Sum dot snapshots
     tick_report = calc_snapshot_damage(damage_events)
     # get correct timestamps from prepare events
@@ -531,6 +636,7 @@ def cardcalc(report, fight_id, token) -> FightInfo:
 
     # remove cards given to pets since the owner's card will account for that
     cards = _clean_up_cards(cards, actors)
+    card_index = CardPlayIndex(cards)
 
     # go through each draw windows and calculate the following
     # (1.) Find the card played during this window and get the damage dealt by
@@ -553,78 +659,32 @@ def cardcalc(report, fight_id, token) -> FightInfo:
     #      (g) correct target in play window
     #      (h) card played
 
-    cardcalc_data = {}
-    count = 0
-    for draw in draws:
-        count += 1
-
-        # find if there was a card played in this window
-        active_cards = _get_active_card(cards, draw)
-        # for now we toss out other active cards
-        card = active_cards[0] if len(active_cards) > 0 else None
-
-        # only handle the play window if there was a card played
-        card_play_data = _handle_card_play(
-            card, cards, damage_report, actors, fight_info)
-
-        # now we can begin compiling data for the draw window as a whole
-        card_draw_data = {}
-
-        # 15s search window corresponding to possible card plays
-        # during the draw window and then search it
-        search_window = SearchWindow(draw.start, draw.end, 15000, 1000)
-        draw_window_damage_collection = search_burst_window(
-            damage_report, search_window, actors)
-
-        draw_window_duration = timedelta(
-            milliseconds=(draw.end-draw.start)).total_seconds()
-
-        (melee_draw_damage_table, ranged_draw_damage_table) = _handle_draw_play_damage(
-            draw_window_damage_collection, draw_window_duration, fight_info, actors)
-
-        if not ranged_draw_damage_table.empty:
-            draw_optimal_time_ranged = fight_info.ToString(
-                time=int(ranged_draw_damage_table['timestamp'].iloc[0]))[:5]
-            draw_optimal_target_ranged = actors.players[ranged_draw_damage_table['id'].iloc[0]].name
-            draw_optimal_damage_ranged = int(
-                ranged_draw_damage_table['damage'].iloc[0])
-        else:
-            draw_optimal_time_ranged = 'None'
-            draw_optimal_target_ranged = 'None'
-            draw_optimal_damage_ranged = 0
-
-        if not melee_draw_damage_table.empty:
-            draw_optimal_time_melee = fight_info.ToString(
-                time=int(melee_draw_damage_table['timestamp'].iloc[0]))[:5]
-            draw_optimal_target_melee = actors.players[melee_draw_damage_table['id'].iloc[0]].name
-            draw_optimal_damage_melee = int(
-                melee_draw_damage_table['damage'].iloc[0])
-        else:
-            draw_optimal_time_melee = 'None'
-            draw_optimal_target_melee = 'None'
-            draw_optimal_damage_melee = 0
-
-        card_draw_data = {
-            'startTime': fight_info.ToString(time=draw.start)[:5],
-            'endTime': fight_info.ToString(time=draw.end)[:5],
-            'startEvent': draw.startEvent,
-            'endEvent': draw.endEvent,
-            'startId': int(draw.startId),
-            'endId': int(draw.endId),
-            'drawDamageTableMelee': melee_draw_damage_table.to_dict(orient='records'),
-            'drawDamageTableRanged': ranged_draw_damage_table.to_dict(orient='records'),
-            'drawOptimalTimeRanged': draw_optimal_time_ranged,
-            'drawOptimalTargetRanged': draw_optimal_target_ranged,
-            'drawOptimalDamageRanged': draw_optimal_damage_ranged,
-            'drawOptimalTimeMelee': draw_optimal_time_melee,
-            'drawOptimalTargetMelee': draw_optimal_target_melee,
-            'drawOptimalDamageMelee': draw_optimal_damage_melee,
-            'count': count,
-        }
+    # 15s search windows corresponding to possible card plays during each
+    # draw window, computed once for the whole fight and then sliced below
+    search_windows = [SearchWindow(draw.start, draw.end, 15000, 1000)
+                      for draw in draws]
+    fight_damage_collection = search_burst_timeline(
+        damage_report, search_windows, actors)
+
+    if workers is not None and workers > 1 and len(draws) > 1:
+        # every draw window only reads these so they are shared with the
+        # worker processes instead of being sent with each draw
+        draw_data = evaluate_parallel(_evaluate_shared_draw_window, list(enumerate(draws, start=1)), {
+            'timestamp': damage_report['timestamp'].to_numpy(dtype=np.float64),
+            'sourceID': damage_report['sourceID'].to_numpy(dtype=np.int64),
+            'amount': damage_report['amount'].to_numpy(dtype=np.int64),
+            'hitType': damage_report['hitType'].cat.codes.to_numpy(),
+            'burstDamage': fight_damage_collection.damage,
+            'burstTimestamps': fight_damage_collection.timestamps,
+        }, (list(damage_report['hitType'].cat.categories), fight_damage_collection.ids, fight_damage_collection.duration,
+            cards, actors, fight_info), workers, pool, _prepare_shared_fight)
+    else:
+        draw_data = [_evaluate_draw_window(count, draw, card_index, damage_report, fight_damage_collection, actors, fight_info)
+                     for (count, draw) in enumerate(draws, start=1)]
 
-        # finally combine the two sets of data and append it to the collection
-        # of data for each draw window/card play
-        combined_data = card_draw_data | card_play_data
+    # collection of data for each draw window/card play
+    cardcalc_data = {}
+    for count, combined_data in enumerate(draw_data, start=1):
         cardcalc_data[count] = combined_data
 
     encounter_info = {
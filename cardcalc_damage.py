@@ -1,7 +1,18 @@
-from cardcalc_data import Player, Pet, SearchWindow, FightInfo, BurstDamageCollection, ActorList
+from cardcalc_data import Player, Pet, SearchWindow, FightInfo, BurstDamageCollection, ActorList, CumulativeDamage, CardCalcException, EventColumns, MISSING_HIT_TYPE
 
+import numpy as np
 import pandas as pd
 
+# builds a dataframe with the given columns from either decoded EventColumns
+# or a list of event dictionaries
+
+
+def _event_frame(events, columns):
+    if isinstance(events, EventColumns):
+        return events.to_frame(columns)
+    return pd.DataFrame(events, columns=columns)
+
+
 """
 Takes a bunch of buff/debuff events for dots and combines it
 with the damage events for those dots creating a single 
@@ -13,67 +24,81 @@ containing all damage done by the dot
 # TODO: only return the tick damage snapshot events
 # all other damage event handling will be done elsewhere
 
+SNAPSHOT_COLUMNS = ['timestamp', 'type', 'sourceID',
+                    'targetID', 'abilityGameID', 'amount', 'hitType', 'directHit']
+
 
 def calc_snapshot_damage(damage_events):
-    active_debuffs = {}
-    summed_tick_damage = []
-
-    for event in damage_events['tickDamage']:
-        action = (event['sourceID'], event['targetID'], event['abilityGameID'])
-
-        # these events are either:
-        # - apply{buff/debuff}
-        # - reapply{buff,debuff}
-        # - remove{buff,debuff} (can ignore these)
-        # - damage
-
-        # damage is summed from the application (apply or reapply) until
-        # another application event or the end of the data
-
-        # that damage is then associated with the timestamp
-        # for the (re)application event
-
-        if event['type'] in ['applybuff', 'refreshbuff', 'applydebuff', 'refreshdebuff'] and event['timestamp']:
-            # if it's not an active effect then add it
-            if action not in active_debuffs:
-                active_debuffs[action] = {
-                    'timestamp': event['timestamp'],
-                    'damage': 0,
-                }
-            # if it is an active debuff then add a new damage event associated
-            # with the sum and restart summing the damage from this event
-            else:
-                summed_tick_damage.append({
-                    'type': 'damagesnapshot',
-                    'sourceID': action[0],
-                    'targetID': action[1],
-                    'abilityGameID': action[2],
-                    'amount': active_debuffs[action]['damage'],
-                    'timestamp': active_debuffs[action]['timestamp'],
-                })
-                active_debuffs[action] = {
-                    'timestamp': event['timestamp'],
-                    'damage': 0,
-                }
-        elif event['type'] == 'damage':
-            if action in active_debuffs:
-                active_debuffs[action]['damage'] += event['amount']
-
-    # now that we're done we can add the remaining events into the damage array
-    for action in active_debuffs:
-        if active_debuffs[action]['damage'] != 0:
-            summed_tick_damage.append({
-                'type': 'damagesnapshot',
-                'sourceID': action[0],
-                'targetID': action[1],
-                'abilityGameID': action[2],
-                'amount': active_debuffs[action]['damage'],
-                'timestamp': active_debuffs[action]['timestamp'],
-            })
+    events = _event_frame(damage_events['tickDamage'], [
+                          'timestamp', 'type', 'sourceID', 'targetID', 'abilityGameID', 'amount'])
+
+    # these events are either:
+    # - apply{buff/debuff}
+    # - reapply{buff,debuff}
+    # - remove{buff,debuff} (can ignore these)
+    # - damage
+
+    # damage is summed from the application (apply or reapply) until
+    # another application event for the same (source, target, ability)
+    # or the end of the data
+
+    # that damage is then associated with the timestamp
+    # for the (re)application event
+    is_application = events['type'].isin(
+        ['applybuff', 'refreshbuff', 'applydebuff', 'refreshdebuff']) & (events['timestamp'] != 0)
+    is_damage = events['type'] == 'damage'
+
+    action = events.groupby(['sourceID', 'targetID', 'abilityGameID'],
+                            sort=False, dropna=False).ngroup()
+
+    # number each application in order and give every event the number of
+    # the application it follows for the same action (damage before the
+    # first application has none and is ignored)
+    application_count = int(is_application.sum())
+    application_id = pd.Series(np.nan, index=events.index)
+    application_id[is_application] = np.arange(application_count)
+    application_id = application_id.groupby(action).ffill()
+
+    counted = is_damage & application_id.notna()
+    damage = np.bincount(application_id[counted].to_numpy(dtype=np.intp),
+                         weights=events.loc[counted, 'amount'].to_numpy(
+                             dtype=np.float64),
+                         minlength=application_count).astype(np.int64)
+
+    applications = events[is_application].copy()
+    applications['amount'] = damage
+    applications['action'] = action[is_application]
+    applications['position'] = np.flatnonzero(is_application)
+
+    # an application is closed by the next one for the same action while the
+    # last one is only kept if some damage followed it
+    grouped_position = applications.groupby('action')['position']
+    next_position = grouped_position.shift(-1)
+    is_last = next_position.isna()
+    applications = applications[~is_last | (applications['amount'] != 0)]
+
+    # keep the order the snapshots are closed in so ties in the timestamp sort
+    # match summing the events one at a time
+    closed_order = next_position.where(
+        ~is_last, len(events) + grouped_position.transform('first'))
+    applications = applications.assign(closed=closed_order).sort_values(
+        by='closed', kind='stable')
+
+    if applications.empty:
+        damage_report = pd.DataFrame([], columns=SNAPSHOT_COLUMNS)
+    else:
+        damage_report = pd.DataFrame({
+            'timestamp': applications['timestamp'].to_numpy(),
+            'type': 'damagesnapshot',
+            'sourceID': applications['sourceID'].to_numpy(),
+            'targetID': applications['targetID'].to_numpy(),
+            'abilityGameID': applications['abilityGameID'].to_numpy(),
+            'amount': applications['amount'].to_numpy(),
+            'hitType': np.full(len(applications), np.nan),
+            'directHit': np.full(len(applications), np.nan),
+        }, columns=SNAPSHOT_COLUMNS)
 
     # finally sort the new array of snapshotdamage events and return it
-    damage_report = pd.DataFrame(summed_tick_damage, columns=[
-                                 'timestamp', 'type', 'sourceID', 'targetID', 'abilityGameID', 'amount', 'hitType', 'directHit'])
     damage_report.sort_values(by='timestamp', inplace=True, ignore_index=True)
     return damage_report
 
@@ -86,7 +111,14 @@ Old function for handling tick damage, is deprecated now
 def calc_tick_damage(damage_events):
     instanced_tick_damage = []
 
-    for event in damage_events['tickDamage']:
+    tick_damage = damage_events['tickDamage']
+    raw_damage = damage_events['rawDamage']
+    if isinstance(tick_damage, EventColumns):
+        tick_damage = tick_damage.to_dicts()
+    if isinstance(raw_damage, EventColumns):
+        raw_damage = raw_damage.to_dicts()
+
+    for event in tick_damage:
         if event['type'] == 'damage':
             instanced_tick_damage.append({
                 'timestamp': event['timestamp'],
@@ -101,23 +133,46 @@ def calc_tick_damage(damage_events):
     sorted_tick_damage = sorted(
         instanced_tick_damage, key=lambda tick: tick['timestamp'])
 
-    damage_report = pd.DataFrame(sorted(sorted_tick_damage + damage_events['rawDamage'], key=lambda tick: tick['timestamp']), columns=[
+    damage_report = pd.DataFrame(sorted(sorted_tick_damage + raw_damage, key=lambda tick: tick['timestamp']), columns=[
                                  'timestamp', 'type', 'sourceID', 'targetID', 'abilityGameID', 'amount', 'hitType', 'directHit'])
 
     return damage_report
 
 
+"""
+Encodes the given columns of two dataframes into a single int64 key per row
+where sorting on the key gives the same order as sorting on the columns and
+equal rows (across both frames) get equal keys
+"""
+
+
+def _encode_join_keys(left, right, columns):
+    keys = np.zeros(len(left) + len(right), dtype=np.int64)
+
+    for column in columns:
+        codes, uniques = pd.factorize(pd.concat([left[column], right[column]], ignore_index=True),
+                                      sort=True, use_na_sentinel=False)
+        # re-number the combined keys after each column so they stay dense
+        # and can never overflow
+        _, keys = np.unique(keys * len(uniques) + codes, return_inverse=True)
+
+    return keys[:len(left)], keys[len(left):]
+
+
 """
 Given a collection of raw damage events and the prepares events 
 corresponding to those this combines them and returns just the raw 
 damage events with new timestamps from the preparing snapshot
 """
 
+PREPARE_KEY = ['packetID', 'sourceID',
+               'targetID', 'targetInstance', 'abilityGameID']
+
 
 def cleanup_prepare_events(damage_events):
-    damages = pd.DataFrame(damage_events['rawDamage'], columns=['type', 'sourceID', 'targetID',
+    damages = _event_frame(damage_events['rawDamage'], ['type', 'sourceID', 'targetID',
                            'targetInstance', 'abilityGameID', 'packetID', 'amount', 'hitType', 'directHit', 'timestamp'])
-    prepares = pd.DataFrame(damage_events['prepDamage'], columns=[
+    prepares = _event_frame(damage_events['prepDamage'], [
                             'timestamp', 'sourceID', 'targetID', 'targetInstance', 'abilityGameID', 'packetID'])
 
     # packetID sorting (for debug purposes)
@@ -130,19 +185,28 @@ def cleanup_prepare_events(damage_events):
     # change duplicate name
     damages.rename(inplace=True, columns={'timestamp': 'damage_time'})
 
-    damages.set_index(inplace=True, drop=True, keys=[
-                      'packetID', 'sourceID', 'targetID', 'targetInstance', 'abilityGameID'])
-    # , 'damage_time'])
-    prepares.set_index(inplace=True, drop=True, keys=[
-                       'packetID', 'sourceID', 'targetID', 'targetInstance', 'abilityGameID'])
+    damage_keys, prepare_keys = _encode_join_keys(
+        damages, prepares, PREPARE_KEY)
 
-    prepares = prepares[~prepares.index.duplicated(keep='first')]
-    # .index.drop_duplicates(keep='first')
+    # only the first prepare event for each key is used, np.unique also
+    # returns the keys sorted so each damage event can binary search them
+    prepare_keys, first_prepare = np.unique(prepare_keys, return_index=True)
+    position = np.searchsorted(prepare_keys, damage_keys)
+    matched = position < len(prepare_keys)
+    matched[matched] = prepare_keys[position[matched]] == damage_keys[matched]
 
-    merged_damage = pd.merge(left=damages, right=prepares, how="left",
-                             sort='timestamp', left_index=True, right_index=True, validate='m:1')
+    # row of the matching prepare event for each damage event (or -1 which
+    # is missing from the index and gives NaN)
+    prepare_rows = np.full(len(damage_keys), -1, dtype=np.int64)
+    prepare_rows[matched] = first_prepare[position[matched]]
+
+    # the joined events are ordered by their key
+    order = np.argsort(damage_keys, kind='stable')
+    merged_damage = damages[PREPARE_KEY + [column for column in damages.columns if column not in PREPARE_KEY]].take(
+        order).reset_index(drop=True)
+    merged_damage['timestamp'] = prepares['timestamp'].reindex(
+        prepare_rows[order]).to_numpy()
 
-    merged_damage.reset_index(inplace=True)
     return merged_damage
 
 # this take a raw damage report with snapshot damage already resolved
@@ -155,17 +219,34 @@ def cleanup_prepare_events(damage_events):
 # (d.) critical direct hit - 4
 # (e.) dot snapshot - 5
 
+HIT_TYPES = ['normal', 'dh', 'crit', 'cdh', 'dot', 'n/a']
+HIT_DETAIL_TYPES = ['normal', 'dh', 'crit', 'cdh', 'dot']
+
 
 def cleanup_hit_data(damage_report):
-    damage_report['hitType'].fillna(value=1.0, inplace=True)
+    # decoded events mark a missing hitType with MISSING_HIT_TYPE rather
+    # than NaN
+    damage_report['hitType'] = damage_report['hitType'].fillna(
+        value=1.0).replace(MISSING_HIT_TYPE, 1)
     damage_report['directHit'].fillna(value=False, inplace=True)
 
-    damage_report.rename(columns={'hitType': 'hitData'}, inplace=True)
+    # same classification as hit_type() but evaluated over whole columns
+    hit_data = damage_report['hitType']
+    direct_hit = damage_report['directHit'].eq(True)
+    not_direct_hit = damage_report['directHit'].eq(False)
 
-    damage_report['hitType'] = damage_report.apply(
-        lambda row: hit_type(row), axis=1)  # TODO: optimize
+    hit_types = np.select([
+        damage_report['type'] == 'damagesnapshot',
+        (hit_data == 1) & not_direct_hit,
+        (hit_data == 1) & direct_hit,
+        (hit_data == 2) & not_direct_hit,
+        (hit_data == 2) & direct_hit,
+    ], ['dot', 'normal', 'dh', 'crit', 'cdh'], default='n/a')
 
-    damage_report.drop(inplace=True, columns=['hitData', 'directHit', 'type'])
+    damage_report.drop(inplace=True, columns=[
+                       'hitType', 'directHit', 'type'])
+
+    damage_report['hitType'] = pd.Categorical(hit_types, categories=HIT_TYPES)
 
     return damage_report
 
@@ -191,31 +272,82 @@ def hit_type(row):
         return 'n/a'
 
 
+def _effective_card_bonus(card, actors: ActorList):
+    # check the real bonus received
+    eff_bonus = 1.0
+
+    if card.target in actors.players:
+        if card.role == actors.players[card.target].role:
+            eff_bonus = card.bonus
+        else:
+            eff_bonus = 1.0 + ((card.bonus - 1.0)/2.0)
+    elif card.target in actors.pets:
+        if card.role == actors.players[actors.pets[card.target].owner].role:
+            eff_bonus = card.bonus
+        else:
+            eff_bonus = 1.0 + ((card.bonus - 1.0)/2.0)
+
+    return eff_bonus
+
+
+# events are sorted on sourceID * CARD_KEY_SCALE + timestamp so that the
+# damage done by one actor during one card window is a contiguous range
+CARD_KEY_SCALE = 1 << 42
+
+
 def compute_remove_card_damage(damage_report,
                                cards,
                                actors: ActorList):
-    for card in cards:
-        # check the real bonus received
-        eff_bonus = 1.0
-
-        if card.target in actors.players:
-            if card.role == actors.players[card.target].role:
-                eff_bonus = card.bonus
-            else:
-                eff_bonus = 1.0 + ((card.bonus - 1.0)/2.0)
-        elif card.target in actors.pets:
-            if card.role == actors.players[actors.pets[card.target].owner].role:
-                eff_bonus = card.bonus
-            else:
-                eff_bonus = 1.0 + ((card.bonus - 1.0)/2.0)
-
-        # check if there are any valid damage values for the active card holder during it's time window (this should be non-empty but especially for pets may sometimes not be)
-        if damage_report.loc[lambda df: (df['timestamp'] >= card.start) & (df['timestamp'] <= card.end) & (df['sourceID'] == card.target), 'amount'].empty:
-            next
-        else:
-            # modify all values with the correct sourceID that lie between the start event and end event times for the card
-            damage_report.loc[lambda df: (df['timestamp'] >= card.start) & (df['timestamp'] <= card.end) & (df['sourceID'] == card.target), 'amount'] = damage_report.loc[lambda df: (
-                df['timestamp'] >= card.start) & (df['timestamp'] <= card.end) & (df['sourceID'] == card.target), 'amount'].transform(lambda x: int(x/eff_bonus))
+    if not cards or damage_report.empty:
+        return damage_report
+
+    divisors = np.array([_effective_card_bonus(card, actors)
+                        for card in cards])
+    targets = np.array([card.target for card in cards], dtype=np.int64)
+    starts = np.array([card.start for card in cards], dtype=np.int64)
+    ends = np.array([card.end for card in cards], dtype=np.int64)
+
+    # events without a timestamp can't fall inside any card window
+    timestamps = damage_report['timestamp'].fillna(-1).to_numpy(dtype=np.int64)
+    keys = damage_report['sourceID'].to_numpy(
+        dtype=np.int64) * CARD_KEY_SCALE + timestamps
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    # range of sorted events covered by each card (start and end inclusive)
+    lower = np.searchsorted(
+        sorted_keys, targets * CARD_KEY_SCALE + starts, side='left')
+    upper = np.searchsorted(
+        sorted_keys, targets * CARD_KEY_SCALE + ends, side='right')
+    upper = np.maximum(lower, upper)
+
+    # count the cards covering each event and sum their (1-based) indices so
+    # that events covered by exactly one card know which card it was
+    coverage = np.zeros(len(keys) + 1, dtype=np.int64)
+    card_sum = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.add.at(coverage, lower, 1)
+    np.add.at(coverage, upper, -1)
+    np.add.at(card_sum, lower, np.arange(1, len(cards) + 1))
+    np.add.at(card_sum, upper, -np.arange(1, len(cards) + 1))
+
+    sorted_coverage = np.cumsum(coverage[:-1])
+    sorted_card = np.cumsum(card_sum[:-1]) - 1
+
+    amounts = damage_report['amount'].to_numpy(copy=True)
+
+    single = order[sorted_coverage == 1]
+    amounts[single] = np.trunc(
+        amounts[single] / divisors[sorted_card[sorted_coverage == 1]])
+
+    # events inside overlapping card windows have each bonus removed in turn
+    # in the same order as the cards
+    overlapped = sorted_coverage > 1
+    if overlapped.any():
+        for index in range(len(cards)):
+            rows = order[lower[index]:upper[index]][overlapped[lower[index]:upper[index]]]
+            amounts[rows] = np.trunc(amounts[rows] / divisors[index])
+
+    damage_report['amount'] = amounts
 
     return damage_report
 
@@ -226,45 +358,21 @@ def compute_total_damage(damage_report,
                          actors: ActorList,
                          detailedInfo: bool = False):
 
-    ###
-    # TODO: this function is likely the whole computational time
-    # of this project right now so any work to optimize this will
-    # greatly aid the performance of this project
-    ###
-
-    combined_damage = {}
-    hit_details = {}
-
     # create a dataframe with only the current time window
     current_df = damage_report.loc[lambda df: (df['timestamp'] >= start_time) & (
-        df['timestamp'] <= end_time)]  # TODO: optimize
+        df['timestamp'] <= end_time)]
 
-    # for each unique actor present, sum the damage done during this time frame
-    for actor in current_df['sourceID'].unique():
-        combined_damage[actor] = current_df.loc[lambda df: df['sourceID']
-                                                == actor, 'amount'].sum()  # TODO: optimize
+    # sum the damage done by each actor present during this time frame
+    combined_damage = current_df.groupby(
+        'sourceID', sort=False)['amount'].sum().to_dict()
 
     # get detailed info on crit/dh rates and percentage of damage from dots
+    # from a single actor x hitType table
+    hit_details = {}
     if detailedInfo:
-        for actor in current_df['sourceID'].unique():
-            normal = current_df.loc[lambda df: (df['sourceID'] == actor) & (
-                df['hitType'] == 'normal'), 'amount'].sum()
-            dh = current_df.loc[lambda df: (df['sourceID'] == actor) & (
-                df['hitType'] == 'dh'), 'amount'].sum()
-            crit = current_df.loc[lambda df: (df['sourceID'] == actor) & (
-                df['hitType'] == 'crit'), 'amount'].sum()
-            cdh = current_df.loc[lambda df: (df['sourceID'] == actor) & (
-                df['hitType'] == 'cdh'), 'amount'].sum()
-            dot = current_df.loc[lambda df: (df['sourceID'] == actor) & (
-                df['hitType'] == 'dot'), 'amount'].sum()
-
-            hit_details[actor] = {
-                'normal': normal,
-                'dh': dh,
-                'crit': crit,
-                'cdh': cdh,
-                'dot': dot,
-            }
+        hit_table = current_df.groupby(['sourceID', 'hitType'], sort=False, observed=True)['amount'].sum().unstack(
+            fill_value=0).reindex(index=list(combined_damage), columns=HIT_DETAIL_TYPES, fill_value=0)
+        hit_details = hit_table.to_dict(orient='index')
 
     # combine play and pet info as well as create empty entries for actors
     # without any damage done in the current window
@@ -315,6 +423,56 @@ def compute_total_damage(damage_report,
         return (combined_damage, player_damage, pet_damage)
 
 
+"""
+Builds running damage totals for each player over that player's sorted
+damage events so the damage done in any time window is just two lookups
+and a subtraction per player. Pet damage is added to the column of the
+pet's owner and damage from any other actor is ignored.
+"""
+
+
+def compute_cumulative_damage(damage_report,
+                              actors: ActorList):
+    ids = list(actors.players)
+    for _, pet in actors.pets.items():
+        if pet.owner not in ids:
+            ids.append(pet.owner)
+
+    columns = {pid: index for index, pid in enumerate(ids)}
+    for pid, pet in actors.pets.items():
+        columns[pid] = columns[pet.owner]
+
+    ordered = damage_report.sort_values(by='timestamp', kind='stable')
+    column = ordered['sourceID'].map(columns)
+    valid = column.notna().to_numpy()
+
+    timestamps = ordered['timestamp'].to_numpy()[valid]
+    amounts = ordered['amount'].to_numpy()[valid]
+    column = column.to_numpy()[valid].astype(np.intp)
+
+    # group the events by column keeping them in time order within each
+    # column, then each player's running total is a cumsum over their own
+    # events only
+    grouped = np.argsort(column, kind='stable')
+    bounds = np.searchsorted(column[grouped], np.arange(len(ids) + 1))
+
+    player_timestamps = []
+    player_damage = []
+    for index in range(len(ids)):
+        events = grouped[bounds[index]:bounds[index + 1]]
+        player_timestamps.append(timestamps[events])
+        player_damage.append(_running_total(amounts[events]))
+
+    return CumulativeDamage(ids, player_timestamps, player_damage)
+
+
+# running total of amounts with a leading zero
+def _running_total(amounts):
+    total = np.zeros(len(amounts) + 1, dtype=amounts.dtype)
+    np.cumsum(amounts, out=total[1:])
+    return total
+
+
 """
 This searches a window of time for the optimal card play
 
@@ -323,62 +481,106 @@ start_time: initial value for the search interval to start
 end_time: final time that the interval can start
 duration: the length of the interval (in milliseconds)
 step_size: step_size for the search (in milliseconds)
+
+cumulative_damage can be passed in to reuse the running damage totals
+from compute_cumulative_damage instead of rebuilding them
 """
 
 
 def search_burst_window(damage_report,
                         search_window: SearchWindow,
-                        actors: ActorList):
+                        actors: ActorList,
+                        cumulative_damage: CumulativeDamage = None):
 
-    # start searching at the start
-    interval_start = search_window.start
-    interval_end = interval_start + search_window.duration
+    if cumulative_damage is None:
+        cumulative_damage = compute_cumulative_damage(damage_report, actors)
 
-    damage_collection = []
+    interval_starts = np.arange(
+        search_window.start, search_window.end, search_window.step, dtype=np.int64)
 
-    while interval_start < search_window.end:
-        (_, total_damage, _) = compute_total_damage(damage_report,
-                                                    interval_start, interval_end, actors, detailedInfo=False)
+    return BurstDamageCollection(cumulative_damage.window_damage(interval_starts, search_window.duration),
+                                 interval_starts, cumulative_damage.ids, search_window.duration)
 
-        # add all values to the collection at this timestamp
-        current_damage = total_damage
-        current_damage['timestamp'] = interval_start
-        damage_collection.append(current_damage)
 
-        interval_start += search_window.step
-        interval_end = interval_start + search_window.duration
+"""
+Computes a single burst damage matrix covering every search window (for
+cardcalc these are the draw windows which together span the whole fight)
+so each window can be read back as a view with BurstDamageCollection.window
+instead of being searched separately. The intervals for each window are
+still stepped from that window's own start so the values match running
+search_burst_window on each window, this only holds when the windows don't
+overlap (otherwise slicing one window picks up the other's intervals) so
+overlapping windows raise a CardCalcException. All windows must share a
+duration.
+"""
 
-    damage_df = pd.DataFrame(damage_collection)
-    damage_df.set_index('timestamp', drop=True, inplace=True)
-    return BurstDamageCollection(damage_df, search_window.duration)
 
+def search_burst_timeline(damage_report,
+                          search_windows: list[SearchWindow],
+                          actors: ActorList,
+                          cumulative_damage: CumulativeDamage = None):
 
-def compute_time_averaged_dps(damage_report,
-                              start_time: int,
-                              end_time: int,
-                              step_size: int,
-                              time_range: int):
+    if len({window.duration for window in search_windows}) > 1:
+        raise CardCalcException(
+            "Search windows must all have the same duration")
 
-    average_dps = []
+    ordered_windows = sorted(search_windows, key=lambda window: window.start)
+    for (previous, window) in zip(ordered_windows, ordered_windows[1:]):
+        if window.start < previous.end:
+            raise CardCalcException("Search windows must not overlap")
 
-    current_time = start_time
-    min_time = max(current_time - time_range, start_time)
-    max_time = min(current_time + time_range, end_time)
+    if cumulative_damage is None:
+        cumulative_damage = compute_cumulative_damage(damage_report, actors)
 
-    # sum up all
-    while current_time < end_time:
-        time_delta = (max_time - min_time)/1000
+    interval_starts = np.unique(np.concatenate([np.empty(0, dtype=np.int64)] + [
+        np.arange(window.start, window.end, window.step, dtype=np.int64) for window in search_windows]))
+    duration = search_windows[0].duration if search_windows else 0
 
-        step_damage = damage_report.loc[lambda df: (df['timestamp'] <= max_time) & (
-            df['timestamp'] >= min_time), 'amount'].sum()
+    return BurstDamageCollection(cumulative_damage.window_damage(interval_starts, duration),
+                                 interval_starts, cumulative_damage.ids, duration)
 
-        average_dps.append({
-            'timestamp': current_time,
-            'dps': step_damage/time_delta,
-        })
 
-        current_time += step_size
-        min_time = max(current_time - time_range, start_time)
-        max_time = min(current_time + time_range, end_time)
+"""
+Computes the average dps at every step between start_time and end_time using
+the damage done within time_range (in milliseconds) either side of it
+
+If actors are given then the average dps of each player (including their
+pets) is also returned with one column per player id
+"""
+
 
-    return pd.DataFrame(average_dps)
+def compute_time_averaged_dps(damage_report,
+                              start_time: int,
+                              end_time: int,
+                              step_size: int,
+                              time_range: int,
+                              actors: ActorList = None):
+
+    current_times = np.arange(start_time, end_time, step_size, dtype=np.int64)
+    min_times = np.maximum(current_times - time_range, start_time)
+    max_times = np.minimum(current_times + time_range, end_time)
+    time_deltas = (max_times - min_times)/1000
+
+    # running total of all damage done over the sorted timestamps
+    timed_report = damage_report[damage_report['timestamp'].notna()]
+    order = np.argsort(timed_report['timestamp'].to_numpy(), kind='stable')
+    amounts = timed_report['amount'].to_numpy()[order]
+
+    cumulative_damage = CumulativeDamage(
+        ['dps'], [timed_report['timestamp'].to_numpy()[order]], [_running_total(amounts)])
+    step_damage = cumulative_damage.window_damage(
+        min_times, max_times - min_times)[:, 0]
+
+    average_dps = pd.DataFrame({
+        'timestamp': current_times,
+        'dps': step_damage/time_deltas,
+    })
+
+    if actors is not None:
+        cumulative_damage = compute_cumulative_damage(damage_report, actors)
+        player_damage = cumulative_damage.window_damage(
+            min_times, max_times - min_times)
+        average_dps = pd.concat([average_dps, pd.DataFrame(
+            player_damage/time_deltas[:, np.newaxis], columns=cumulative_damage.ids)], axis=1)
+
+    return average_dps
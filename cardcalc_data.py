@@ -1,4 +1,8 @@
+from bisect import bisect_left, bisect_right
 from datetime import timedelta
+from itertools import accumulate
+from threading import Lock
+import numpy as np
 import pandas as pd
 
 
@@ -225,6 +229,50 @@ class CardPlay:
         }[id]
 
 
+class CardPlayIndex:
+    def __init__(self, cards):
+        self.cards = cards
+
+        # card positions sorted by cast time
+        self.cast_order = sorted(range(len(cards)), key=lambda i: cards[i].cast)
+        self.casts = [cards[i].cast for i in self.cast_order]
+        # latest cast time seen so far when walking the cards in order
+        self.latest_casts = list(accumulate(
+            (card.cast for card in cards), max))
+
+        # card positions for each target sorted by start time
+        self.target_order = {}
+        for i in sorted(range(len(cards)), key=lambda i: cards[i].start):
+            self.target_order.setdefault(cards[i].target, []).append(i)
+        self.target_starts = {target: [cards[i].start for i in order]
+                              for target, order in self.target_order.items()}
+
+        self.max_duration = max(
+            (card.end - card.start for card in cards), default=0)
+
+    # returns the cards (in order) cast after start and no later than end,
+    # stopping at the first card cast after end like a scan through the
+    # cards in order would
+    def cast_between(self, start, end):
+        limit = bisect_right(self.latest_casts, end)
+        lower = bisect_right(self.casts, start)
+        upper = bisect_right(self.casts, end)
+        return [self.cards[i] for i in sorted(self.cast_order[lower:upper]) if i < limit]
+
+    # returns the cards (in order) on the given target which started before
+    # and end after the given time
+    def active_at(self, time, target):
+        if target not in self.target_order:
+            return []
+
+        # only cards starting within the longest card duration before time
+        # can still be active
+        starts = self.target_starts[target]
+        lower = bisect_right(starts, time - self.max_duration)
+        upper = bisect_left(starts, time)
+        return [self.cards[i] for i in sorted(self.target_order[target][lower:upper]) if self.cards[i].end > time]
+
+
 class SearchWindow:
     def __init__(self, start, end, duration, step):
         self.start = start
@@ -233,6 +281,31 @@ class SearchWindow:
         self.step = step
 
 
+class CumulativeDamage:
+    def __init__(self, ids, timestamps, damage):
+        # player id for each column of damage
+        self.ids = ids
+        # sorted timestamps of each player's damage events
+        self.timestamps = timestamps
+        # running damage totals for each player where entry i is the sum of
+        # the player's first i events (entry 0 is zero)
+        self.damage = damage
+
+    # returns the damage done by each player over [start, start + duration]
+    # for every start time given as a (len(starts), len(ids)) array
+    def window_damage(self, starts, duration):
+        ends = starts + duration
+        dtype = self.damage[0].dtype if self.damage else np.int64
+        window_damage = np.zeros((len(starts), len(self.ids)), dtype=dtype)
+
+        for (column, (timestamps, damage)) in enumerate(zip(self.timestamps, self.damage)):
+            lower = np.searchsorted(timestamps, starts, side='left')
+            upper = np.searchsorted(timestamps, ends, side='right')
+            window_damage[:, column] = damage[upper] - damage[lower]
+
+        return window_damage
+
+
 class DrawWindow:
     def __init__(self, source=0, start=0, end=0, castId=-2, buffId=0):
         self.source = source
@@ -371,10 +444,48 @@ class FightInfo:
 
 
 class BurstDamageCollection:
-    def __init__(self, df, duration):
-        self.df = df
+    def __init__(self, damage, timestamps, ids, duration):
+        # (len(timestamps), len(ids)) array of the damage done by each player
+        # in the interval starting at each timestamp
+        self.damage = damage
+        self.timestamps = timestamps
+        self.ids = ids
         self.duration = duration
 
+        self.columns = {pid: index for index, pid in enumerate(ids)}
+
+        # timestamps on a regular grid are mapped to rows arithmetically,
+        # anything else falls back to a binary search
+        steps = np.diff(timestamps)
+        if len(steps) > 0 and steps[0] > 0 and (steps == steps[0]).all():
+            self.step = int(steps[0])
+        else:
+            self.step = None
+
+    @property
+    def df(self):
+        return pd.DataFrame(self.damage, index=pd.Index(self.timestamps, name='timestamp'), columns=self.ids)
+
+    # returns the row for the given timestamp or None if it isn't present
+    def get_row(self, time):
+        if self.step is not None:
+            (row, offset) = divmod(time - int(self.timestamps[0]), self.step)
+            if offset == 0 and 0 <= row < len(self.timestamps):
+                return int(row)
+            return None
+
+        row = np.searchsorted(self.timestamps, time, side='left')
+        if row < len(self.timestamps) and self.timestamps[row] == time:
+            return int(row)
+        return None
+
+    # returns a collection sharing this one's data but only covering the
+    # rows with start <= timestamp < end
+    def window(self, start, end):
+        lower = np.searchsorted(self.timestamps, start, side='left')
+        upper = np.searchsorted(self.timestamps, end, side='left')
+        return BurstDamageCollection(self.damage[lower:upper], self.timestamps[lower:upper], self.ids, self.duration)
+
     # this returns a tuple with the (timestamp, id, damage) set which is the
     # max
     def get_max(self, pid=None, time=None, limit=0):
@@ -387,32 +498,35 @@ class BurstDamageCollection:
         #     timestamp assuming it's valid
 
         # if a limit is provided (limit > 0) then only search values less than the limit
-        # TODO: this is actually really slow, would like to improve it
         if limit > 0:
-            # array = np.array(self.df.values.tolist())
-            # mod_df = pd.DataFrame(np.where(array > limit, 0, array).tolist(), index=self.df.index, columns=self.df.columns)
-            mod_df = self.df.apply(
-                lambda x: [y if y < limit else 0 for y in x])
+            damage = np.where(self.damage < limit, self.damage, 0)
         else:
-            mod_df = self.df
+            damage = self.damage
+
+        row = self.get_row(time) if time is not None else None
+        column = self.columns.get(pid) if pid is not None else None
 
         max_dmg = 0
-        if time is None and pid is None:
+        if time is None and pid is None and damage.size > 0:
             # get overall max damage, person, and time
-            pid = mod_df.max(axis=0).idxmax()
-            time = mod_df.max(axis=1).idxmax()
-            max_dmg = mod_df.loc[time, pid]
-        elif pid is None and time is not None and time in mod_df.index.values:
+            column = np.argmax(damage.max(axis=0))
+            row = np.argmax(damage.max(axis=1))
+            pid = self.ids[column]
+            time = self.timestamps[row]
+            max_dmg = damage[row, column]
+        elif pid is None and row is not None:
             # get max damage and the person for this time
-            pid = mod_df.loc[time, :].idxmax()
-            max_dmg = mod_df.loc[time, pid]
-        elif pid is not None and pid in mod_df.columns.values and time is None:
+            column = np.argmax(damage[row])
+            pid = self.ids[column]
+            max_dmg = damage[row, column]
+        elif column is not None and time is None and len(self.timestamps) > 0:
             # get the max damage done by this person and at what time
-            time = mod_df[pid].idxmax()
-            max_dmg = mod_df.loc[time, pid]
-        elif pid is not None and pid in mod_df.columns.values and time is not None and time in mod_df.index.values:
+            row = np.argmax(damage[:, column])
+            time = self.timestamps[row]
+            max_dmg = damage[row, column]
+        elif column is not None and row is not None:
             # return the damage at time done by the given player
-            max_dmg = mod_df.loc[time, pid]
+            max_dmg = damage[row, column]
         else:
             # some error
             time = 0
@@ -420,3 +534,166 @@ class BurstDamageCollection:
             max_dmg = 0
 
         return [int(time), int(pid), int(max_dmg)]
+
+    # returns up to count [timestamp, id, damage] entries with the highest
+    # (positive) damage done by the given players in descending order while
+    # skipping any entry within separation ms of a higher damage entry
+    # already chosen for the same player. Equal damage is taken in player
+    # then time order
+    def get_top(self, pids, count, separation):
+        columns = np.sort([self.columns[pid]
+                          for pid in pids if pid in self.columns]).astype(np.intp)
+        rows = len(self.timestamps)
+        if count <= 0 or rows == 0 or len(columns) == 0:
+            return []
+
+        # flatten in player then time order
+        damage = self.damage[:, columns].T.ravel()
+
+        # every entry examined is either chosen or skipped because of a
+        # chosen entry and each chosen entry can only cause a few entries to
+        # be skipped so only the highest values need to be sorted
+        if self.step is not None:
+            min_step = self.step
+        elif rows > 1:
+            min_step = int(np.diff(self.timestamps).min())
+        else:
+            min_step = separation
+        per_entry = 2 * -(-separation // max(min_step, 1)) - 1
+        pool_size = count * max(per_entry, 1)
+
+        candidates = np.flatnonzero(damage > 0)
+        if len(candidates) > pool_size:
+            threshold = np.partition(
+                damage[candidates], len(candidates) - pool_size)[len(candidates) - pool_size]
+            candidates = candidates[damage[candidates] >= threshold]
+        candidates = candidates[np.lexsort(
+            (candidates, -damage[candidates]))]
+
+        candidate_columns = candidates // rows
+        candidate_times = self.timestamps[candidates % rows]
+        available = np.ones(len(candidates), dtype=bool)
+
+        top = []
+        while len(top) < count and available.any():
+            index = np.argmax(available)
+            top.append([int(candidate_times[index]),
+                        int(self.ids[columns[candidate_columns[index]]]),
+                        int(damage[candidates[index]])])
+            available &= ~((candidate_columns == candidate_columns[index]) & (
+                np.abs(candidate_times - candidate_times[index]) < separation))
+
+        return top
+
+
+"""
+Typed columns for the fields used from FFLogs events along with the value
+used when an event doesn't have that field
+"""
+
+EVENT_COLUMNS = {
+    'timestamp': (np.int64, 0),
+    'sourceID': (np.int32, -1),
+    'targetID': (np.int32, -1),
+    'targetInstance': (np.int32, 0),
+    'abilityGameID': (np.int32, -1),
+    'packetID': (np.int32, -1),
+    'amount': (np.int64, 0),
+    'hitType': (np.int8, -1),
+    'directHit': (np.bool_, False),
+}
+MISSING_HIT_TYPE = -1
+
+# every event type string seen so far, events store their type as an index
+# into this list
+EVENT_TYPES = ['damage', 'calculateddamage', 'applybuff', 'applybuffstack', 'applydebuff', 'applydebuffstack', 'refreshbuff',
+               'refreshdebuff', 'removebuff', 'removebuffstack', 'removedebuff', 'removedebuffstack', 'cast', 'begincast']
+_event_type_codes = {name: code for (code, name) in enumerate(EVENT_TYPES)}
+# events are decoded from several threads at once so new types are added
+# under a lock, a type is appended before its code is published so any code
+# read without the lock is already a valid index
+_event_types_lock = Lock()
+
+
+def _event_type_code(name):
+    code = _event_type_codes.get(name)
+    if code is None:
+        with _event_types_lock:
+            code = _event_type_codes.get(name)
+            if code is None:
+                code = len(EVENT_TYPES)
+                EVENT_TYPES.append(name)
+                _event_type_codes[name] = code
+    return code
+
+
+class EventColumns:
+    def __init__(self, columns: dict, types):
+        # arrays for each of EVENT_COLUMNS with one entry per event
+        self.columns = columns
+        # index into EVENT_TYPES for each event
+        self.types = types
+
+    @staticmethod
+    def decode(events: list):
+        columns = {name: np.array([event.get(name, missing) for event in events], dtype=dtype)
+                   for (name, (dtype, missing)) in EVENT_COLUMNS.items()}
+
+        names = [event['type'] for event in events]
+        for name in set(names):
+            _event_type_code(name)
+        types = np.array([_event_type_codes[name]
+                         for name in names], dtype=np.int16)
+
+        return EventColumns(columns, types)
+
+    @staticmethod
+    def concat(parts: list):
+        if not parts:
+            return EventColumns.decode([])
+        return EventColumns({name: np.concatenate([part.columns[name] for part in parts]) for name in EVENT_COLUMNS},
+                            np.concatenate([part.types for part in parts]))
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, name):
+        if name == 'type':
+            return np.array(EVENT_TYPES, dtype=object)[self.types]
+        return self.columns[name]
+
+    # returns the events at the given positions in that order
+    def take(self, indices):
+        return EventColumns({name: column[indices] for (name, column) in self.columns.items()}, self.types[indices])
+
+    def to_frame(self, columns: list):
+        return pd.DataFrame({name: self[name] for name in columns}, columns=columns)
+
+    # the events as dictionaries again (only with the fields in
+    # EVENT_COLUMNS)
+    def to_dicts(self):
+        frame = self.to_frame(['type'] + list(EVENT_COLUMNS))
+        return frame.to_dict('records')
+
+
+# collects events one at a time decoding them into EventColumns in batches
+# so only batch_size event dictionaries are held at once
+class EventColumnsBuilder:
+    def __init__(self, batch_size=5000):
+        self.batch_size = batch_size
+        self.parts = []
+        self.pending = []
+
+    def append(self, event):
+        self.pending.append(event)
+        if len(self.pending) >= self.batch_size:
+            self.parts.append(EventColumns.decode(self.pending))
+            self.pending = []
+
+    def finish(self):
+        if self.pending or not self.parts:
+            self.parts.append(EventColumns.decode(self.pending))
+            self.pending = []
+        if len(self.parts) == 1:
+            return self.parts[0]
+        return EventColumns.concat(self.parts)
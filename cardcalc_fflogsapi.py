@@ -4,17 +4,33 @@ as required for damage and card calculations used in cardcalc
 and damagecalc
 """
 
+import asyncio
+from bisect import bisect_left, bisect_right
 from datetime import timedelta
+import json
 import os
+import tempfile
+from threading import Lock
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Imports related to making API requests
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2 import BackendApplicationClient
-from python_graphql_client import GraphqlClient
 from urllib.parse import urlparse, parse_qs
 
+import numpy as np
+
 # local imports
-from cardcalc_data import Player, Pet, FightInfo, CardCalcException, ActorList
+from cardcalc_data import Player, Pet, FightInfo, CardCalcException, ActorList, EventColumns, EventColumnsBuilder, EVENT_TYPES
+from cardcalc_transport import Transport
+from cardcalc_cache import EventCache, MetadataCache, query_hash
+from cardcalc_ratelimit import RateLimitScheduler, with_rate_limit
+from cardcalc_jsonstream import parse_chunks
 
 FFLOGS_CLIENT_ID = os.environ['FFLOGS_CLIENT_ID']
 FFLOGS_CLIENT_SECRET = os.environ['FFLOGS_CLIENT_SECRET']
@@ -22,7 +38,47 @@ FFLOGS_CLIENT_SECRET = os.environ['FFLOGS_CLIENT_SECRET']
 FFLOGS_OAUTH_URL = 'https://www.fflogs.com/oauth/token'
 FFLOGS_URL = 'https://www.fflogs.com/api/v2/client'
 
-client = GraphqlClient(FFLOGS_URL)
+# timeouts (seconds) and retries can be tuned through the environment
+transport = Transport(FFLOGS_URL,
+                      timeout=(float(os.environ.get('FFLOGS_CONNECT_TIMEOUT', 5)),
+                               float(os.environ.get('FFLOGS_READ_TIMEOUT', 60))),
+                      retries=int(os.environ.get('FFLOGS_RETRIES', 3)))
+
+# every request waits for its share of the FFLogs point budget, batch
+# requests are limited to FFLOGS_BATCH_SHARE of it and interactive requests
+# wait at most FFLOGS_INTERACTIVE_WAIT seconds for it
+scheduler = RateLimitScheduler(
+    batch_share=float(os.environ.get('FFLOGS_BATCH_SHARE', 0.8)),
+    max_interactive_wait=float(os.environ.get('FFLOGS_INTERACTIVE_WAIT', 20)))
+
+# report metadata is kept for a short time while a report may still be
+# logged live (it ended recently) and much longer once it's finished
+metadata_cache = MetadataCache()
+LIVE_REPORT_WINDOW = 2 * 60 * 60
+LIVE_REPORT_TTL = 30
+FINISHED_REPORT_TTL = 6 * 60 * 60
+
+# raw responses for fight data (events and tables) are kept on disk when
+# FFLOGS_EVENT_CACHE names a directory to keep them in
+event_cache = None
+if os.environ.get('FFLOGS_EVENT_CACHE'):
+    event_cache = EventCache(os.environ['FFLOGS_EVENT_CACHE'],
+                             int(os.environ.get('FFLOGS_EVENT_CACHE_MB', 256)) * 1024 * 1024)
+
+# the arguments used for each of the events queries
+EVENT_QUERIES = {
+    'cardPlayEvents': 'filterExpression: "ability.id in (1001883, 1001886, 1001887, 1001882, 1001884, 1001885, 4401, 4402, 4403, 4404, 4405, 4406)"',
+    'draws': 'filterExpression: "ability.id in (3590, 1000915, 1000913, 1000914, 1000917, 1000916, 1000918)"',
+    'damage': 'dataType: DamageDone, filterExpression: "isTick=\'false\' and type!=\'calculateddamage\'"',
+    'damagePrep': 'dataType: DamageDone, filterExpression: "isTick=false and type=\'calculateddamage\' and isUnpairedCalculation=false"',
+    'tickDamage': 'dataType: DamageDone, filterExpression: "isTick=\'true\' and ability.id != 500000"',
+    'tickEvents': 'dataType: Debuffs, hostilityType: Enemies, filterExpression: "ability.id not in (1000493, 1001203, 1001195, 1001221)"',
+    'groundEvents': 'dataType: Buffs, filterExpression: "ability.id in (1000749, 1000501, 1001205, 1000312, 1001869)"',
+}
+
+# the damage events queries which are combined into get_damage_events
+DAMAGE_EVENT_QUERIES = ['damage', 'damagePrep',
+                        'tickDamage', 'tickEvents', 'groundEvents']
 
 # this is used to handle sorting events
 
@@ -54,41 +110,290 @@ def get_bearer_token():
                               client_id=FFLOGS_CLIENT_ID, client_secret=FFLOGS_CLIENT_SECRET)
     return token
 
+
+# the expiry time of a token, computed from expires_in if the token doesn't
+# already carry an expires_at
+def _token_expiry(token):
+    if 'expires_at' in token:
+        return token['expires_at']
+    return time.time() + token.get('expires_in', 0)
+
+
+"""
+Keeps a bearer token and replaces it before it expires, the token is shared
+with other processes (e.g. the other gunicorn workers) through a small file
+so only one of them has to fetch a new one. The file is locked while the
+token is being replaced so workers starting together don't all request a
+token at once
+"""
+
+
+class TokenCache:
+    def __init__(self, path=None, refresh_margin=600):
+        if path is None:
+            path = os.environ.get('FFLOGS_TOKEN_CACHE', os.path.join(
+                tempfile.gettempdir(), 'astcardcalc-token.json'))
+        self.path = path
+        # tokens expiring in less than this many seconds are replaced
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self._lock = Lock()
+
+    def _valid(self, token):
+        return token is not None and _token_expiry(token) - self.refresh_margin > time.time()
+
+    def _read_file(self):
+        try:
+            with open(self.path) as token_file:
+                return json.load(token_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_file(self, token):
+        (handle, temp_path) = tempfile.mkstemp(
+            dir=os.path.dirname(self.path) or '.')
+        try:
+            with os.fdopen(handle, 'w') as token_file:
+                json.dump(dict(token, expires_at=_token_expiry(token)), token_file)
+            os.replace(temp_path, self.path)
+        except OSError:
+            # the token still works for this process without being shared
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    # returns a valid token, fetching a new one only if neither this
+    # process nor the shared file has one which is still good
+    def get(self):
+        token = self.token
+        if self._valid(token):
+            return token
+
+        with self._lock:
+            if self._valid(self.token):
+                return self.token
+
+            lock_file = None
+            try:
+                if fcntl is not None:
+                    try:
+                        lock_file = open(self.path + '.lock', 'a')
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    except OSError:
+                        lock_file = None
+
+                token = self._read_file()
+                if not self._valid(token):
+                    token = get_bearer_token()
+                    self._write_file(token)
+            finally:
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    lock_file.close()
+
+            self.token = token
+            return token
+
 # make a request for the data defined in query given a set of
-# variables
+# variables, the request is held back until it fits in the point budget
+#
+# the data arrays of any events aliases named in columns are decoded into
+# EventColumns while the response is still being read so the response
+# never has to be held in memory as a whole, sink (see EventCache.writer) is
+# sent the raw response when given
 
 
-def call_fflogs_api(query, variables, token):
+def call_fflogs_api(query, variables, token, columns=(), sink=None):
     headers = {
-        'Content-TYpe': 'application/json',
         'Authorization': 'Bearer {}'.format(token['access_token']),
     }
-    data = client.execute(query=query, variables=variables, headers=headers)
+    body = {'query': with_rate_limit(query), 'variables': variables}
+
+    cost = scheduler.estimate(query)
+    with scheduler.reserve(cost):
+        if columns:
+            data = transport.post_json_stream(
+                body, _columns_parser(columns), headers=headers, sink=sink)
+        else:
+            data = transport.post_json(body, headers=headers)
+
+        rate_limit_data = (data.get('data') or {}).pop('rateLimitData', None)
+        if rate_limit_data is not None:
+            scheduler.update(rate_limit_data, cost)
 
     return data
 
 
-def get_last_fight(report, token):
+def _columns_parser(columns):
+    collectors = {('data', 'reportData', 'report', alias, 'data'): EventColumnsBuilder
+                  for alias in columns}
+    return lambda chunks: parse_chunks(chunks, collectors)
+
+
+# makes a request through the event cache when a fight is given, this
+# should only be used for data which can't change once the fight is over
+# (i.e. not the list of fights in a report)
+
+
+def _cached_call(query, variables, token, report=None, fight=None, columns=()):
+    if event_cache is None or fight is None:
+        return call_fflogs_api(query, variables, token, columns)
+
+    key = query_hash(query, variables)
+
+    if not columns:
+        data = event_cache.get(report, fight, key)
+        if data is None:
+            data = call_fflogs_api(query, variables, token)
+            if 'errors' not in data:
+                event_cache.put(report, fight, key, data)
+        return data
+
+    # responses with events decoded into columns are read from and written
+    # to the cache in chunks as well
+    chunks = event_cache.read_chunks(report, fight, key)
+    if chunks is not None:
+        try:
+            return _columns_parser(columns)(chunks)
+        except (OSError, EOFError, ValueError):
+            pass
+
+    writer = event_cache.writer(report, fight, key)
+    try:
+        data = call_fflogs_api(query, variables, token, columns, writer)
+    except Exception:
+        writer.discard()
+        raise
+
+    if 'errors' in data:
+        writer.discard()
+    else:
+        writer.commit()
+    return data
+
+
+# the query and variables for the first page of one of EVENT_QUERIES, the
+# following pages are requested by moving startTime to nextPageTimestamp
+
+
+def _event_pages_request(report, start_time, end_time, event_query, fight_ids=None):
     variables = {
-        'code': report
+        'code': report,
+        'startTime': start_time,
+        'endTime': end_time,
     }
+    fight_filter = ''
+    fight_variable = ''
+    if fight_ids is not None:
+        variables['fightIDs'] = list(fight_ids)
+        fight_filter = 'fightIDs: $fightIDs,'
+        fight_variable = ', $fightIDs: [Int]!'
+
     query = """
-query reportData($code: String!) {
+query reportData($code: String!, $startTime: Float!, $endTime: Float!""" + fight_variable + """) {
     reportData {
         report(code: $code) {
-            fights {
-                id
-                startTime
-                endTime
-                name
-                kill
+            events(
+                startTime: $startTime,
+                endTime: $endTime,
+                """ + fight_filter + """
+                limit: 10000,
+                """ + EVENT_QUERIES[event_query] + """
+            ) {
+                data
+                nextPageTimestamp
             }
         }
     }
 }
 """
-    data = call_fflogs_api(query, variables, token)
-    return data['data']['reportData']['report']['fights'][-1]['id']
+
+    return query, variables
+
+
+"""
+Yields each page of events for one of EVENT_QUERIES between start_time and
+end_time (optionally only for the given fights) following nextPageTimestamp
+until all of the events have been read. Each page is only requested once
+the previous one has been consumed and is a list of events or, if columns
+is set, EventColumns
+"""
+
+
+def iter_event_pages(report, start_time, end_time, event_query, token, fight_ids=None, fight=None, columns=False):
+    (query, variables) = _event_pages_request(
+        report, start_time, end_time, event_query, fight_ids)
+
+    while variables['startTime'] is not None:
+        data = _cached_call(query, variables, token, report,
+                            fight, ('events',) if columns else ())
+        page = data['data']['reportData']['report']['events']
+        variables['startTime'] = page['nextPageTimestamp']
+        yield page['data']
+
+
+# returns a generator over each event across all pages of an events query
+def iter_events(report, start_time, end_time, event_query, token, fight_ids=None, fight=None):
+    pages = iter_event_pages(report, start_time, end_time,
+                             event_query, token, fight_ids, fight)
+
+    return (event for page in pages for event in page)
+
+
+# returns every event for an events query given its first page, following
+# up with more requests only if that page was cut short
+
+
+def _read_events(report, page, end_time, event_query, token, fight_ids=None, fight=None):
+    pages = [page['data']]
+    if page['nextPageTimestamp'] is not None:
+        pages += iter_event_pages(report, page['nextPageTimestamp'], end_time, event_query,
+                                  token, fight_ids, fight, isinstance(page['data'], EventColumns))
+
+    return _join_pages(pages)
+
+
+def _join_pages(pages):
+    if isinstance(pages[0], EventColumns):
+        return pages[0] if len(pages) == 1 else EventColumns.concat(pages)
+    return [event for page in pages for event in page]
+
+
+"""
+Returns the report's metadata (endTime, fights and masterData pets) from
+metadata_cache or a single request if it isn't cached
+"""
+
+
+def get_report_metadata(report, token):
+    metadata = metadata_cache.get(report)
+    if metadata is not None:
+        return metadata
+
+    metadata = _query_report(report, REPORT_FIELDS, token)
+
+    if _is_live(metadata):
+        metadata_cache.put(report, metadata, LIVE_REPORT_TTL)
+    else:
+        metadata_cache.put(report, metadata, FINISHED_REPORT_TTL)
+
+    return metadata
+
+
+# whether fights may still be added to the report, endTime is in
+# milliseconds since the epoch and is missing while a report is being logged
+def _is_live(metadata):
+    end_time = metadata.get('endTime')
+    return end_time is None or time.time() - end_time / 1000 < LIVE_REPORT_WINDOW
+
+
+def get_last_fight(report, token):
+    # the last fight of a live report may have changed since its metadata
+    # was cached
+    metadata = metadata_cache.get(report)
+    if metadata is not None and _is_live(metadata):
+        metadata_cache.discard(report)
+
+    return get_report_metadata(report, token)['fights'][-1]['id']
 
 
 def decompose_url(url, token) -> tuple[str, int]:
@@ -112,66 +417,38 @@ def decompose_url(url, token) -> tuple[str, int]:
     return report_id, fight_id
 
 
+def get_report_fights(report, token) -> list[FightInfo]:
+    fights = get_report_metadata(report, token)['fights']
+
+    return [_fight_info(report, f) for f in fights]
+
+
 def get_fight_info(report, fight, token):
-    variables = {
-        'code': report
-    }
-    query = """
-query reportData($code: String!) {
-    reportData {
-        report(code: $code) {
-            fights {
-                id
-                startTime
-                endTime
-                name
-                kill
-            }
-        }
-    }
-}
-"""
-    data = call_fflogs_api(query, variables, token)
-    fights = data['data']['reportData']['report']['fights']
+    cached = metadata_cache.get(report) is not None
 
-    for f in fights:
-        if f['id'] == fight:
-            return FightInfo(report_id=report, fight_number=f['id'], start_time=f['startTime'], end_time=f['endTime'], name=f['name'], kill=f['kill'])
+    for f in get_report_fights(report, token):
+        if f.index == fight:
+            return f
+
+    # the fight may have been uploaded since the metadata was cached
+    if cached:
+        metadata_cache.discard(report)
+        for f in get_report_fights(report, token):
+            if f.index == fight:
+                return f
 
     raise CardCalcException("Fight ID not found in report")
 
 
 def get_actor_lists(fight_info: FightInfo, token):
-    variables = {
-        'code': fight_info.id,
-        'startTime': fight_info.start,
-        'endTime': fight_info.end,
-    }
-    query = """
-query reportData($code: String!, $startTime: Float!, $endTime: Float) {
-    reportData {
-        report(code: $code) {
-            masterData {
-                pets: actors(type: "Pet") {
-                    id
-                    name
-                    type
-                    subType
-                    petOwner
-                }
-            }
-            table: table(startTime: $startTime, endTime: $endTime)
-        }
-    }
-}"""
+    pet_list = get_report_metadata(fight_info.id, token)['masterData']['pets']
+    report = _query_report(fight_info.id, _table_field(
+        'table', fight_info.start, fight_info.end), token, fight_info.index)
 
-    data = call_fflogs_api(query, variables, token)
-    master_data = data['data']['reportData']['report']['masterData']
-    table = data['data']['reportData']['report']['table']
+    return _build_actor_list(pet_list, report['table']['data']['composition'])
 
-    pet_list = master_data['pets']
-    composition = table['data']['composition']
 
+def _build_actor_list(pet_list, composition):
     players = {}
     pets = {}
 
@@ -186,65 +463,17 @@ query reportData($code: String!, $startTime: Float!, $endTime: Float) {
 
 
 def get_card_play_events(fight_info: FightInfo, token):
-    variables = {
-        'code': fight_info.id,
-        'startTime': fight_info.start,
-        'endTime': fight_info.end,
-    }
-    query = """
-query reportData($code: String!, $startTime: Float!, $endTime: Float!) {
-    reportData {
-        report(code: $code) {
-            cardPlayEvents: events(
-                startTime: $startTime, 
-                endTime: $endTime
-                filterExpression: "ability.id in (1001883, 1001886, 1001887, 1001882, 1001884, 1001885, 4401, 4402, 4403, 4404, 4405, 4406)"
-            ) {
-                data
-            }
-        }
-    }
-}
-"""
-
-    data = call_fflogs_api(query, variables, token)
-    card_events = data['data']['reportData']['report']['cardPlayEvents']['data']
-
-    return card_events
+    return list(iter_events(fight_info.id, fight_info.start, fight_info.end, 'cardPlayEvents', token, fight=fight_info.index))
 
 
 def get_card_draw_events(fight_info: FightInfo, token):
-    variables = {
-        'code': fight_info.id,
-        'startTime': fight_info.start,
-        'endTime': fight_info.end,
-    }
-    query = """
-query reportData($code: String!, $startTime: Float!, $endTime: Float!) {
-    reportData {
-        report(code: $code) {
-            draws: events(
-                startTime: $startTime,
-                endTime: $endTime,
-                filterExpression: "ability.id in (3590, 1000915, 1000913, 1000914, 1000917, 1000916, 1000918)"
-                ) {
-                    data
-                }
-        }
-    }
-}
-"""
-
-    data = call_fflogs_api(query, variables, token)
-    card_events = data['data']['reportData']['report']['draws']['data']
-
-    return card_events
+    return list(iter_events(fight_info.id, fight_info.start, fight_info.end, 'draws', token, fight=fight_info.index))
 
 
 """
 Get the collection of damage events from FFLogs for a fight 
 defined in fight_info
-Returns dictionary of damage events with three sections:
+Returns dictionary of damage events (as EventColumns) with three sections:
 - prepDamage: the prepare event snapshots for non-tick damage
 - rawDamage: the actual damage events for non-tick damage
 - tickDamage: buff/debuff events and damage events for tick damage
@@ -252,82 +481,248 @@ Returns dictionary of damage events with three sections:
 
 
 def get_damage_events(fight_info: FightInfo, token):
+    report = _query_report(fight_info.id, _events_fields(
+        fight_info.start, fight_info.end, event_queries=DAMAGE_EVENT_QUERIES), token, fight_info.index, DAMAGE_EVENT_QUERIES)
+
+    # all of the first pages come back together, any query with more events
+    # than that is then followed up on its own
+    return _combine_damage_events(*[_read_events(fight_info.id, report[event_query], fight_info.end, event_query, token, fight=fight_info.index)
+                                    for event_query in DAMAGE_EVENT_QUERIES])
+
+
+# decodes a list of events unless they have been already
+def _as_columns(events):
+    if isinstance(events, EventColumns):
+        return events
+    return EventColumns.decode(events)
+
+
+def _combine_damage_events(base_damages, prep_damages, tick_damages, tick_events, ground_events):
+    tick_columns = EventColumns.concat(
+        [_as_columns(events) for events in (tick_damages, tick_events, ground_events)])
+
+    # sort the ticks by timestamp and then event priority (the sort is
+    # stable so the order they were combined in breaks any other ties)
+    priorities = np.zeros(len(EVENT_TYPES), dtype=np.int64)
+    for code in np.unique(tick_columns.types):
+        priorities[code] = _event_priority(EVENT_TYPES[code])
+    order = np.lexsort(
+        (priorities[tick_columns.types], tick_columns['timestamp']))
+
+    damage_events = {
+        'rawDamage': _as_columns(base_damages),
+        'prepDamage': _as_columns(prep_damages),
+        'tickDamage': tick_columns.take(order),
+    }
+    return damage_events
+
+
+"""
+Everything below plans the requests for a whole calculation so that as
+few round trips as possible are made. Everything which only needs the
+report code is asked for in one request and everything which needs the
+fight times in a second one, only event queries with more than one page
+need any further requests
+"""
+
+REPORT_FIELDS = """
+            endTime
+            fights {
+                id
+                startTime
+                endTime
+                name
+                kill
+            }
+            masterData {
+                pets: actors(type: "Pet") {
+                    id
+                    name
+                    type
+                    subType
+                    petOwner
+                }
+            }"""
+
+
+def _query_report(report, fields, token, fight=None, columns=()):
     variables = {
-        'code': fight_info.id,
-        'startTime': fight_info.start,
-        'endTime': fight_info.end,
+        'code': report
     }
     query = """
-query reportData($code: String!, $startTime: Float!, $endTime: Float!) {
+query reportData($code: String!) {
     reportData {
-        report(code: $code) {
-            damage: events(
-                startTime: $startTime,
-                endTime: $endTime,
-                dataType: DamageDone,
-                limit: 10000,
-                filterExpression: "isTick='false' and type!='calculateddamage'"
-            ) {
-                data
-            }
-            damagePrep: events(
-                startTime: $startTime,
-                endTime: $endTime,
-                dataType: DamageDone,
-                limit: 10000,
-                filterExpression: "isTick=false and type='calculateddamage' and isUnpairedCalculation=false"
-            ) {
-                data
-            }
-
-            tickDamage: events(
-                startTime: $startTime,
-                endTime: $endTime,
-                dataType: DamageDone,
-                limit: 10000,
-                filterExpression: "isTick='true' and ability.id != 500000"
-            ) {
-                data
-            }
-            tickEvents: events(
-                startTime: $startTime,
-                endTime: $endTime,
-                dataType: Debuffs,
-                hostilityType: Enemies,
-                limit: 10000,
-                filterExpression: "ability.id not in (1000493, 1001203, 1001195, 1001221)"
-            ) {
-                data
-            }
-            groundEvents: events(
-                startTime: $startTime,
-                endTime: $endTime,
-                dataType: Buffs,
-                limit: 10000,
-                filterExpression: "ability.id in (1000749, 1000501, 1001205, 1000312, 1001869)"
-            ) {
-                data
-            }
+        report(code: $code) {""" + fields + """
         }
     }
-}
+}"""
+
+    data = _cached_call(query, variables, token, report, fight, columns)
+    return data['data']['reportData']['report']
+
+
+# the composition table for a fight aliased as the given name
+def _table_field(alias, start_time, end_time):
+    return """
+            {}: table(startTime: {}, endTime: {})""".format(alias, start_time, end_time)
+
+
+# each of event_queries (by default all of EVENT_QUERIES) aliased by its
+# name
+def _events_fields(start_time, end_time, fight_ids=None, event_queries=None):
+    if event_queries is None:
+        event_queries = list(EVENT_QUERIES)
+
+    fight_filter = ''
+    if fight_ids is not None:
+        fight_filter = 'fightIDs: [{}], '.format(
+            ', '.join([str(i) for i in fight_ids]))
+
+    return ''.join(["""
+            {}: events(startTime: {}, endTime: {}, {}limit: 10000, {}) {{
+                data
+                nextPageTimestamp
+            }}""".format(event_query, start_time, end_time, fight_filter, EVENT_QUERIES[event_query])
+        for event_query in event_queries])
+
+
+def _fight_info(report, fight) -> FightInfo:
+    return FightInfo(report_id=report, fight_number=fight['id'], start_time=fight['startTime'], end_time=fight['endTime'], name=fight['name'], kill=fight['kill'])
+
+
+# splits a list of events sorted by timestamp into the events for each fight
+def _split_events(events, fights: list[FightInfo]):
+    if isinstance(events, EventColumns):
+        timestamps = events['timestamp']
+        return {f.index: events.take(slice(np.searchsorted(timestamps, f.start, 'left'), np.searchsorted(timestamps, f.end, 'right')))
+                for f in fights}
+
+    timestamps = [event['timestamp'] for event in events]
+    return {f.index: events[bisect_left(timestamps, f.start):bisect_right(timestamps, f.end)]
+            for f in fights}
+
+
+"""
+asyncio versions of the requests for a whole fight or report
+
+Requests are still made through the pooled transport but from worker
+threads, so queries which don't depend on each other are in flight at the
+same time. A semaphore bounds how many requests run at once
 """
 
-    data = call_fflogs_api(query, variables, token)
+DEFAULT_CONCURRENCY = 4
 
-    prep_damages = data['data']['reportData']['report']['damagePrep']['data']
-    base_damages = data['data']['reportData']['report']['damage']['data']
+# used in place of a fight id for cached data covering every fight
+REPORT_CACHE_KEY = 'all'
 
-    tick_damages = data['data']['reportData']['report']['tickDamage']['data']
-    tick_events = data['data']['reportData']['report']['tickEvents']['data']
-    ground_events = data['data']['reportData']['report']['groundEvents']['data']
 
-    combined_tick_events = sorted((tick_damages + tick_events + ground_events),
-                                  key=lambda tick: (tick['timestamp'], _event_priority(tick['type'])))
+async def _in_thread(semaphore, function, *args):
+    if semaphore is None:
+        return await asyncio.to_thread(function, *args)
+    async with semaphore:
+        return await asyncio.to_thread(function, *args)
 
-    damage_events = {
-        'rawDamage': base_damages,
-        'prepDamage': prep_damages,
-        'tickDamage': combined_tick_events,
-    }
-    return damage_events
+
+async def _query_report_async(report, fields, token, semaphore=None, fight=None, columns=()):
+    return await _in_thread(semaphore, _query_report, report, fields, token, fight, columns)
+
+
+# the async version of _read_events, the remaining pages of each query are
+# read one after another but separate queries can be read concurrently
+async def _read_events_async(report, page, end_time, event_query, token, semaphore=None, fight_ids=None, fight=None):
+    pages = [page['data']]
+    if page['nextPageTimestamp'] is None:
+        return pages[0]
+
+    columns = ('events',) if isinstance(page['data'], EventColumns) else ()
+    (query, variables) = _event_pages_request(
+        report, page['nextPageTimestamp'], end_time, event_query, fight_ids)
+    while variables['startTime'] is not None:
+        data = await _in_thread(semaphore, _cached_call, query, variables, token, report, fight, columns)
+        next_page = data['data']['reportData']['report']['events']
+        variables['startTime'] = next_page['nextPageTimestamp']
+        pages.append(next_page['data'])
+
+    return _join_pages(pages)
+
+
+"""
+Get everything needed to run cardcalc on a single fight in two requests
+(plus a concurrent follow up for each events query with more than one page)
+Returns (fight_info, actors, card_events, draw_events, damage_events) in the
+same form as the individual get_* functions
+"""
+
+
+async def get_fight_data_async(report, fight, token, concurrency=DEFAULT_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # looking the fight up refreshes the cached metadata if it's missing
+    fight_info = await _in_thread(semaphore, get_fight_info, report, fight, token)
+    pet_list = (await _in_thread(semaphore, get_report_metadata, report, token))['masterData']['pets']
+
+    report_data = await _query_report_async(report, _table_field('table', fight_info.start, fight_info.end) +
+                                            _events_fields(fight_info.start, fight_info.end), token, semaphore, fight_info.index, DAMAGE_EVENT_QUERIES)
+
+    events = dict(zip(EVENT_QUERIES, await asyncio.gather(*[_read_events_async(report, report_data[event_query], fight_info.end, event_query, token, semaphore, fight=fight_info.index)
+                                                            for event_query in EVENT_QUERIES])))
+
+    return (fight_info,
+            _build_actor_list(
+                pet_list, report_data['table']['data']['composition']),
+            events['cardPlayEvents'],
+            events['draws'],
+            _combine_damage_events(*[events[event_query] for event_query in DAMAGE_EVENT_QUERIES]))
+
+
+def get_fight_data(report, fight, token, concurrency=DEFAULT_CONCURRENCY):
+    return asyncio.run(get_fight_data_async(report, fight, token, concurrency))
+
+
+"""
+Get everything needed to run cardcalc on every fight in the report (or only
+the fights in fight_ids) in two requests (plus a concurrent follow up for
+each events query with more than one page)
+Returns (fights, actor_lists, fight_events) where actor_lists and
+fight_events are dictionaries keyed by fight id, fight_events holds the same
+(card_events, draw_events, damage_events) each per fight query returns
+"""
+
+
+async def get_report_data_async(report, token, fight_ids=None, concurrency=DEFAULT_CONCURRENCY):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    report_data = await _in_thread(semaphore, get_report_metadata, report, token)
+
+    fights = sorted([_fight_info(report, f) for f in report_data['fights']
+                     if fight_ids is None or f['id'] in fight_ids],
+                    key=lambda f: f.start)
+    if not fights:
+        return fights, {}, {}
+    pet_list = report_data['masterData']['pets']
+
+    fight_ids = [f.index for f in fights]
+    start_time = fights[0].start
+    end_time = fights[-1].end
+
+    report_data = await _query_report_async(report, ''.join([_table_field('fight{}'.format(f.index), f.start, f.end) for f in fights]) +
+                                            _events_fields(start_time, end_time, fight_ids), token, semaphore, REPORT_CACHE_KEY, DAMAGE_EVENT_QUERIES)
+
+    actor_lists = {f.index: _build_actor_list(pet_list, report_data['fight{}'.format(f.index)]['data']['composition'])
+                   for f in fights}
+
+    events = await asyncio.gather(*[_read_events_async(report, report_data[event_query], end_time, event_query, token, semaphore, fight_ids, REPORT_CACHE_KEY)
+                                    for event_query in EVENT_QUERIES])
+    split_events = {event_query: _split_events(query_events, fights)
+                    for (event_query, query_events) in zip(EVENT_QUERIES, events)}
+
+    fight_events = {f.index: (split_events['cardPlayEvents'][f.index],
+                              split_events['draws'][f.index],
+                              _combine_damage_events(*[split_events[event_query][f.index] for event_query in DAMAGE_EVENT_QUERIES]))
+                    for f in fights}
+
+    return fights, actor_lists, fight_events
+
+
+def get_report_data(report, token, fight_ids=None, concurrency=DEFAULT_CONCURRENCY):
+    return asyncio.run(get_report_data_async(report, token, fight_ids, concurrency))
@@ -0,0 +1,135 @@
+"""
+Incremental parsing of JSON documents read in chunks
+
+Only the objects leading to the arrays of interest are walked as they
+arrive, each element of those arrays is decoded on its own and handed to a
+collector (which can convert it to a more compact form right away) so the
+whole document never has to be held in memory. Every other value is
+decoded normally
+"""
+
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+# characters which can follow a complete value
+_VALUE_END = _WHITESPACE + ',:]}'
+
+
+class _ChunkBuffer:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text = ''
+        self.pos = 0
+        self.done = False
+
+    # adds the next chunk to the buffer dropping everything already read,
+    # returns False once there are no more chunks
+    def fill(self):
+        for chunk in self.chunks:
+            if chunk:
+                self.text = self.text[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.done = True
+        return False
+
+    # returns the next character that isn't whitespace without reading it
+    def peek(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected '{}' at position {} of JSON chunk".format(
+                char, self.pos))
+        self.pos += 1
+
+    # decodes the complete value starting at the current position, a value
+    # which isn't followed by a character ending it may be incomplete (e.g.
+    # a number cut off at its '.' or 'e') so more is read first. The buffer
+    # is at least doubled before trying again so large values aren't
+    # decoded over and over
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                (value, end) = _decoder.raw_decode(self.text, self.pos)
+                if self.done or (end < len(self.text) and self.text[end] in _VALUE_END):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.done:
+                    raise
+
+            wanted = 2 * (len(self.text) - self.pos)
+            while self.fill() and len(self.text) - self.pos < wanted:
+                pass
+
+
+def _parse(buffer: _ChunkBuffer, path, collectors, prefixes):
+    char = buffer.peek()
+
+    if path in collectors and char == '[':
+        collector = collectors[path]()
+        buffer.expect('[')
+        if buffer.peek() == ']':
+            buffer.pos += 1
+        else:
+            while True:
+                collector.append(buffer.value())
+                char = buffer.peek()
+                buffer.pos += 1
+                if char == ']':
+                    break
+                if char != ',':
+                    raise ValueError("Expected ',' or ']' in JSON array")
+        return collector.finish()
+
+    if path in prefixes and char == '{':
+        result = {}
+        buffer.expect('{')
+        if buffer.peek() == '}':
+            buffer.pos += 1
+            return result
+        while True:
+            key = buffer.value()
+            buffer.expect(':')
+            result[key] = _parse(buffer, path + (key,), collectors, prefixes)
+            char = buffer.peek()
+            buffer.pos += 1
+            if char == '}':
+                break
+            if char != ',':
+                raise ValueError("Expected ',' or '}' in JSON object")
+        return result
+
+    return buffer.value()
+
+
+"""
+Parses the JSON document made up of the given text chunks
+
+collectors maps the path (tuple of keys) of each array to collect to a
+function creating a collector, which needs an append(item) method and a
+finish() method returning the value used in place of the array
+"""
+
+
+def parse_chunks(chunks, collectors: dict):
+    prefixes = {path[:i] for path in collectors for i in range(len(path))}
+
+    buffer = _ChunkBuffer(chunks)
+    document = _parse(buffer, (), collectors, prefixes)
+
+    while buffer.pos < len(buffer.text) or buffer.fill():
+        if buffer.text[buffer.pos:].strip(_WHITESPACE):
+            raise ValueError('Extra data after JSON document')
+        buffer.pos = len(buffer.text)
+
+    return document
@@ -0,0 +1,169 @@
+"""
+Helpers for evaluating draw windows across worker processes
+
+The large numpy arrays used by every draw window are copied into shared
+memory once and each worker maps them back into arrays instead of having
+them pickled for every task. The worker processes are kept in a WorkerPool
+so they can be reused for many jobs
+"""
+
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+import gc
+from multiprocessing import shared_memory
+import pickle
+
+import numpy as np
+
+# the context is pickled into shared memory along with the arrays
+CONTEXT_KEY = '_context'
+
+# arrays and context of the job the current worker process last ran a task
+# for, set by _attach_job and closed when the worker exits
+_worker_job = None
+_worker_memory = []
+_worker_arrays = {}
+_worker_context = None
+
+# copies each array into its own shared memory block and returns the
+# blocks along with the (name, shape, dtype) needed to attach to them
+
+
+def share_arrays(arrays: dict):
+    blocks = []
+    spec = {}
+
+    try:
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(
+                create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+
+            np.ndarray(array.shape, dtype=array.dtype,
+                       buffer=block.buf)[...] = array
+            spec[key] = (block.name, array.shape, array.dtype.str)
+    except Exception:
+        release_arrays(blocks)
+        raise
+
+    return blocks, spec
+
+
+def release_arrays(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def attach_arrays(spec: dict):
+    blocks = []
+    arrays = {}
+
+    for key, (name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        arrays[key].flags.writeable = False
+
+    return blocks, arrays
+
+
+# attaches to the arrays and context of a job (passing them through prepare
+# if it's given), keeping them until the worker is given a task from a
+# different job
+def _attach_job(spec, prepare):
+    global _worker_job, _worker_memory, _worker_arrays, _worker_context
+    if _worker_job == spec[CONTEXT_KEY][0]:
+        return
+
+    _close_worker()
+    _worker_memory, arrays = attach_arrays(spec)
+    _worker_context = pickle.loads(arrays.pop(CONTEXT_KEY))
+    _worker_arrays = arrays
+    if prepare is not None:
+        _worker_context = prepare(_worker_arrays, _worker_context)
+    _worker_job = spec[CONTEXT_KEY][0]
+
+
+def _close_worker():
+    global _worker_job, _worker_memory, _worker_arrays, _worker_context
+    # the arrays (and anything prepared from them) have to be dropped
+    # before the blocks they view are closed
+    _worker_arrays = {}
+    _worker_context = None
+    _worker_job = None
+    gc.collect()
+    for block in _worker_memory:
+        block.close()
+    _worker_memory = []
+
+
+def _init_worker():
+    atexit.register(_close_worker)
+
+
+def _run_task(evaluate, prepare, spec, args):
+    _attach_job(spec, prepare)
+    return evaluate(*args, _worker_arrays, _worker_context)
+
+
+"""
+Pool of worker processes evaluating tasks with shared arrays
+
+The processes are started once and reused for every call to evaluate, so a
+pool should be created once for a batch of work (e.g. all the fights in a
+report) and closed once it's done, either with close() or by using it as a
+context manager
+"""
+
+
+class WorkerPool:
+    def __init__(self, workers: int):
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    # calls evaluate(*args, arrays, context) for each set of args and returns
+    # the results in the same order as tasks, if prepare is given each worker
+    # calls prepare(arrays, context) once and its result is used as context
+    def evaluate(self, evaluate, tasks, arrays: dict, context, prepare=None):
+        context = np.frombuffer(pickle.dumps(context), dtype=np.uint8)
+        blocks, spec = share_arrays({**arrays, CONTEXT_KEY: context})
+
+        try:
+            return list(self.executor.map(_run_task, [evaluate] * len(tasks), [prepare] * len(tasks),
+                                          [spec] * len(tasks), tasks))
+        finally:
+            release_arrays(blocks)
+
+
+"""
+Calls evaluate(*args, arrays, context) for each set of args across a pool of
+worker processes and returns the results in the same order as tasks
+
+evaluate must be a module level function so it can be sent to the workers,
+arrays is a dictionary of numpy arrays placed in shared memory (read only in
+the workers) and context is anything else needed which is shared once with
+each worker. prepare (also module level) can build anything every task
+needs from the arrays and context, each worker calls it once and uses what
+it returns as the context. A pool can be passed in to reuse its processes,
+otherwise one with the given number of workers is started for this call
+"""
+
+
+def evaluate_parallel(evaluate, tasks, arrays: dict, context, workers: int, pool: WorkerPool = None, prepare=None):
+    if pool is not None:
+        return pool.evaluate(evaluate, tasks, arrays, context, prepare)
+
+    with WorkerPool(workers) as pool:
+        return pool.evaluate(evaluate, tasks, arrays, context, prepare)
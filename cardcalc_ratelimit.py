@@ -0,0 +1,180 @@
+"""
+Scheduling of requests against the FFLogs API point budget
+
+FFLogs allows a number of points to be spent each hour. The budget reported
+in rateLimitData is kept up to date from every response and each request
+reserves its estimated cost before it is sent. Requests which don't fit in
+the remaining budget wait (interactive requests ahead of batch ones) until
+enough points are free or the budget resets. Batch requests may only use
+part of the budget so interactive requests can still go ahead, and
+interactive requests give up after a short wait instead of outlasting the
+request they're made for
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from heapq import heapify, heappop, heappush
+from itertools import count
+from threading import Condition
+import time
+
+from cardcalc_data import CardCalcException
+
+INTERACTIVE_PRIORITY = 0
+BATCH_PRIORITY = 1
+
+# rough cost in points of each part of a query, scaled by what's observed
+BASE_COST = 1.0
+EVENTS_COST = 2.0
+TABLE_COST = 2.0
+
+RATE_LIMIT_FIELDS = """
+    rateLimitData {
+        limitPerHour
+        pointsSpentThisHour
+        pointsResetIn
+    }
+"""
+
+# the priority of requests made in the current context
+_request_priority = ContextVar(
+    'request_priority', default=INTERACTIVE_PRIORITY)
+
+
+def current_priority():
+    return _request_priority.get()
+
+
+# runs the requests made inside the block with the given priority
+@contextmanager
+def request_priority(priority):
+    reset = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(reset)
+
+
+# adds the rateLimitData fields to the top level of a query so every
+# response reports the current budget
+def with_rate_limit(query):
+    end = query.rindex('}')
+    return query[:end] + RATE_LIMIT_FIELDS + query[end:]
+
+
+class RateLimitScheduler:
+    def __init__(self, batch_share=0.8, learning_rate=0.2, max_interactive_wait=20.0):
+        # share of the hourly budget batch requests can use
+        self.batch_share = batch_share
+        self.learning_rate = learning_rate
+        # seconds an interactive request waits for the budget before failing
+        self.max_interactive_wait = max_interactive_wait
+
+        self._condition = Condition()
+        self._waiting = []
+        self._order = count()
+
+        # unknown until the first response arrives
+        self.limit = None
+        self.spent = 0.0
+        self.reset_at = None
+        # estimated points of the requests currently in flight
+        self.reserved = 0.0
+        # ratio of observed to estimated cost
+        self.scale = 1.0
+
+    def estimate(self, query):
+        return self.scale * (BASE_COST + EVENTS_COST * query.count('events(') + TABLE_COST * query.count('table('))
+
+    def _budget(self, priority):
+        if priority <= INTERACTIVE_PRIORITY:
+            return self.limit
+        return self.limit * self.batch_share
+
+    def _fits(self, cost, priority):
+        if self.limit is None:
+            return True
+
+        if self.reset_at is not None and time.monotonic() >= self.reset_at:
+            self.spent = 0.0
+            self.reset_at = None
+
+        # a request larger than the whole budget only has to wait until
+        # nothing else has been spent
+        budget = self._budget(priority)
+        return self.spent + self.reserved + min(cost, budget) <= budget
+
+    # how long to wait before checking the budget again if nothing else
+    # wakes the waiting requests
+    def _wait_time(self):
+        if self.reset_at is None:
+            return 1.0
+        return max(min(self.reset_at - time.monotonic(), 60.0), 0.01)
+
+    # reserves cost points for the block, waiting until they fit in the
+    # budget and every request ahead of this one (by priority then arrival)
+    # has gone. Interactive requests raise a CardCalcException if they've
+    # waited for more than max_interactive_wait
+    @contextmanager
+    def reserve(self, cost, priority=None):
+        if priority is None:
+            priority = current_priority()
+
+        deadline = None
+        if priority <= INTERACTIVE_PRIORITY:
+            deadline = time.monotonic() + self.max_interactive_wait
+
+        with self._condition:
+            ticket = (priority, next(self._order))
+            heappush(self._waiting, ticket)
+            while self._waiting[0] != ticket or not self._fits(cost, priority):
+                wait_time = self._wait_time()
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._give_up(ticket)
+                    wait_time = min(wait_time, remaining)
+                self._condition.wait(wait_time)
+            heappop(self._waiting)
+            self.reserved += cost
+            self._condition.notify_all()
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.reserved -= cost
+                self._condition.notify_all()
+
+    # removes a waiting request and raises the error explaining why
+    def _give_up(self, ticket):
+        self._waiting.remove(ticket)
+        heapify(self._waiting)
+        self._condition.notify_all()
+
+        if self.reset_at is None:
+            raise CardCalcException(
+                "FFLogs API rate limit reached, try again later")
+        raise CardCalcException("FFLogs API rate limit reached, try again in {} minutes".format(
+            max(int((self.reset_at - time.monotonic()) // 60) + 1, 1)))
+
+    # updates the budget from a response's rateLimitData, cost is what was
+    # estimated for that request
+    def update(self, rate_limit_data, cost):
+        with self._condition:
+            spent = rate_limit_data['pointsSpentThisHour']
+            reset_at = time.monotonic() + rate_limit_data['pointsResetIn']
+
+            # the estimates are only corrected from requests which ran on
+            # their own in the same hour since otherwise the points can't
+            # be told apart
+            same_hour = self.reset_at is not None and abs(
+                reset_at - self.reset_at) < 5
+            if same_hour and self.reserved == cost and spent > self.spent and cost > 0:
+                observed = (spent - self.spent) / (cost / self.scale)
+                self.scale += self.learning_rate * (observed - self.scale)
+
+            self.limit = rate_limit_data['limitPerHour']
+            self.spent = spent
+            self.reset_at = reset_at
+            self._condition.notify_all()
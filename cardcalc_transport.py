@@ -0,0 +1,201 @@
+"""
+HTTP transport used for requests to the FFLogs API
+
+A single pooled requests.Session is kept so connections (and their TLS
+handshakes) are reused between calls, responses are requested gzip
+compressed and failed requests are retried with a bounded exponential
+backoff. The latency and size of each call is recorded
+"""
+
+import codecs
+from collections import deque
+from threading import Lock
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# responses which are worth trying again after a short wait
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# errors while sending a request or reading its response which are worth
+# trying again, including a response cut off part way through its body
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError)
+
+
+class CallMetrics:
+    def __init__(self, status, latency, request_bytes, response_bytes, decoded_bytes, attempts):
+        self.status = status
+        # seconds from sending the (final) request until the body was read
+        self.latency = latency
+        self.request_bytes = request_bytes
+        # bytes sent over the wire (compressed) and after decoding
+        self.response_bytes = response_bytes
+        self.decoded_bytes = decoded_bytes
+        self.attempts = attempts
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'latency': self.latency,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'decoded_bytes': self.decoded_bytes,
+            'attempts': self.attempts,
+        }
+
+
+class Transport:
+    def __init__(self, url, timeout=(5, 60), retries=3, backoff=0.5, max_backoff=8, pool_size=8, history=100):
+        self.url = url
+        # (connect, read) timeouts in seconds
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Content-Type': 'application/json',
+        })
+
+        # the most recent calls and running totals across every call
+        self._lock = Lock()
+        self.calls = deque(maxlen=history)
+        self.totals = {
+            'calls': 0,
+            'attempts': 0,
+            'latency': 0.0,
+            'request_bytes': 0,
+            'response_bytes': 0,
+            'decoded_bytes': 0,
+        }
+
+    # the wait before the given retry, a Retry-After header is honored but
+    # never waited on for longer than max_backoff
+    def _retry_delay(self, attempt, response=None):
+        delay = self.backoff * (2 ** attempt)
+        if response is not None and 'Retry-After' in response.headers:
+            try:
+                delay = float(response.headers['Retry-After'])
+            except ValueError:
+                pass
+        return min(delay, self.max_backoff)
+
+    def _record(self, metrics: CallMetrics):
+        with self._lock:
+            self.calls.append(metrics)
+            self.totals['calls'] += 1
+            self.totals['attempts'] += metrics.attempts
+            self.totals['latency'] += metrics.latency
+            self.totals['request_bytes'] += metrics.request_bytes
+            self.totals['response_bytes'] += metrics.response_bytes
+            self.totals['decoded_bytes'] += metrics.decoded_bytes
+
+    # posts body as JSON and returns the decoded JSON response, RETRY_ERRORS
+    # and RETRY_STATUS responses are retried up to retries times before the
+    # last error is raised
+    def post_json(self, body, headers=None):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.post(
+                    self.url, json=body, headers=headers, timeout=self.timeout)
+                content = response.content
+            except RETRY_ERRORS:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+            latency = time.perf_counter() - start
+
+            if response.status_code in RETRY_STATUS and attempt < self.retries:
+                time.sleep(self._retry_delay(attempt, response))
+                attempt += 1
+                continue
+
+            self._record(CallMetrics(
+                status=response.status_code,
+                latency=latency,
+                request_bytes=len(response.request.body or b''),
+                response_bytes=int(response.headers.get(
+                    'Content-Length', len(content))),
+                decoded_bytes=len(content),
+                attempts=attempt + 1,
+            ))
+
+            response.raise_for_status()
+            return response.json()
+
+    # yields the (decompressed) response body as text chunks while counting
+    # the bytes read
+    def _iter_text(self, response, counts, chunk_size):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            counts['decoded'] += len(chunk)
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+    # like post_json but the response is read in chunks and handed to parse
+    # (as an iterator of text chunks) instead of being decoded at once, sink
+    # (if given) is restarted for each attempt and sent every chunk parsed
+    def post_json_stream(self, body, parse, headers=None, sink=None, chunk_size=64 * 1024):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.session.post(
+                    self.url, json=body, headers=headers, timeout=self.timeout, stream=True)
+
+                # the response is closed however reading it ends so the
+                # pooled connection is always released
+                try:
+                    if response.status_code in RETRY_STATUS and attempt < self.retries:
+                        time.sleep(self._retry_delay(attempt, response))
+                        attempt += 1
+                        continue
+                    response.raise_for_status()
+
+                    counts = {'decoded': 0}
+                    chunks = self._iter_text(response, counts, chunk_size)
+                    if sink is not None:
+                        sink.start()
+                        chunks = _tee(chunks, sink)
+                    result = parse(chunks)
+                finally:
+                    response.close()
+            except RETRY_ERRORS:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                continue
+            latency = time.perf_counter() - start
+
+            self._record(CallMetrics(
+                status=response.status_code,
+                latency=latency,
+                request_bytes=len(response.request.body or b''),
+                response_bytes=int(response.headers.get(
+                    'Content-Length', counts['decoded'])),
+                decoded_bytes=counts['decoded'],
+                attempts=attempt + 1,
+            ))
+
+            return result
+
+    def close(self):
+        self.session.close()
+
+
+def _tee(chunks, sink):
+    for chunk in chunks:
+        sink.write(chunk)
+        yield chunk
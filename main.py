@@ -3,6 +3,7 @@ import pytz
 import os
 import json
 from collections import OrderedDict
+from threading import Lock, Thread
 from urllib.parse import urlparse, parse_qs
 
 from flask import Flask, render_template, request, \
@@ -10,13 +11,13 @@ from flask import Flask, render_template, request, \
 
 from google.cloud import bigquery
 
-from cardcalc_fflogsapi import decompose_url, get_bearer_token
+from cardcalc_fflogsapi import decompose_url, get_report_fights, TokenCache
 from cardcalc_data import CardCalcException
-from cardcalc_cards import cardcalc
+from cardcalc_cards import cardcalc, iter_cardcalc_report
 
 app = Flask(__name__)
 LAST_CALC_DATE = pytz.UTC.localize(datetime.utcfromtimestamp(1663886556))
-token = get_bearer_token()
+tokens = TokenCache()
 
 client = bigquery.Client('astcardcalc-vm')
 Reports = client.get_table('astcardcalc-vm.Reports.Reports')
@@ -31,8 +32,8 @@ def get_count():
     return report_count
 
 
-def increment_count():
-    report_count = get_count() + 1
+def increment_count(amount=1):
+    report_count = get_count() + amount
 
     sql = """
 UPDATE `astcardcalc-vm.Reports.Counts`
@@ -57,13 +58,74 @@ WHERE computed < {}""".format(computed_cutoff)
         client.query(sql_delete).result()
 
 
+def get_stored_fights(report_id):
+    """Returns the ids of the fights stored for a report and the ids of
+    those computed since LAST_CALC_DATE"""
+    sql = """
+SELECT fight_id, MAX(computed) AS computed FROM `astcardcalc-vm.Reports.Reports`
+WHERE report_id='{}'
+GROUP BY fight_id;
+""".format(report_id)
+    query_res = client.query(sql).result()
+
+    stored = set()
+    current = set()
+    for row in query_res:
+        stored.add(row.get('fight_id'))
+        if row.get('computed') >= LAST_CALC_DATE:
+            current.add(row.get('fight_id'))
+    return stored, current
+
+
+def is_fight_current(report_id, fight_id):
+    """Whether results computed since LAST_CALC_DATE are stored for a fight,
+    checked right before storing so a fight computed by another worker or
+    request in the meantime isn't stored twice"""
+    sql = """
+SELECT COUNT(*) AS total FROM `astcardcalc-vm.Reports.Reports`
+WHERE report_id='{}' AND fight_id={} AND computed >= TIMESTAMP('{}');
+""".format(report_id, fight_id, LAST_CALC_DATE.isoformat())
+    query_res = client.query(sql).result()
+
+    return next(query_res).get('total') > 0
+
+
+def store_report(report_id, fight_id, results, actors, encounter_info, save=True):
+    """Saves newly computed results (unless save is False) and returns them
+    as a report to render"""
+    sql_report = {
+        'report_id': report_id,
+        'fight_id': fight_id,
+        'results': json.dumps(results),
+        'actors': json.dumps(actors),
+        'enc_name': encounter_info['enc_name'],
+        'enc_time': encounter_info['enc_time'],
+        'enc_kill': encounter_info['enc_kill'],
+        'computed': datetime.now().isoformat(),
+    }
+    report = {
+        'report_id': report_id,
+        'fight_id': fight_id,
+        'results': results,
+        'actors': actors,
+        'enc_name': encounter_info['enc_name'],
+        'enc_time': encounter_info['enc_time'],
+        'enc_kill': encounter_info['enc_kill'],
+        'computed': datetime.now(),
+    }
+
+    if save:
+        client.insert_rows_json(Reports, [sql_report])
+    return report
+
+
 @app.route('/', methods=['GET', 'POST'])
 def homepage():
     """Simple form for redirecting to a report, no validation"""
     if request.method == 'POST':
         report_url = request.form['report_url']
         try:
-            report_id, fight_id = decompose_url(report_url, token)
+            report_id, fight_id = decompose_url(report_url, tokens.get())
         except CardCalcException as exception:
             return render_template('error.html', exception=exception)
 
@@ -121,35 +183,16 @@ ORDER BY computed DESC;
         # Compute
         try:
             results, actors, encounter_info = cardcalc(
-                report_id, fight_id, token)
+                report_id, fight_id, tokens.get())
         except CardCalcException as exception:
             return render_template('error.html', exception=exception)
 
-        sql_report = {
-            'report_id': report_id,
-            'fight_id': fight_id,
-            'results': json.dumps(results),
-            'actors': json.dumps(actors),
-            'enc_name': encounter_info['enc_name'],
-            'enc_time': encounter_info['enc_time'],
-            'enc_kill': encounter_info['enc_kill'],
-            'computed': datetime.now().isoformat(),
-        }
-        report = {
-            'report_id': report_id,
-            'fight_id': fight_id,
-            'results': results,
-            'actors': actors,
-            'enc_name': encounter_info['enc_name'],
-            'enc_time': encounter_info['enc_time'],
-            'enc_kill': encounter_info['enc_kill'],
-            'computed': datetime.now(),
-        }
-
-        # print(sql_report)
-        row_result = client.insert_rows_json(Reports, [sql_report])
-        # print(row_result)
-        increment_count()
+        # the fight may have been stored by a report job in the meantime
+        save = not is_fight_current(report_id, fight_id)
+        report = store_report(report_id, fight_id,
+                              results, actors, encounter_info, save)
+        if save:
+            increment_count()
 
     else:
         # print(sql_report['computed'])
@@ -161,31 +204,12 @@ ORDER BY computed DESC;
         if sql_report['computed'] < LAST_CALC_DATE:
             try:
                 results, actors, encounter_info = cardcalc(
-                    report_id, fight_id, token)
+                    report_id, fight_id, tokens.get())
             except CardCalcException as exception:
                 return render_template('error.html', exception=exception)
 
-            sql_report = {
-                'report_id': report_id,
-                'fight_id': fight_id,
-                'results': json.dumps(results),
-                'actors': json.dumps(actors),
-                'enc_name': encounter_info['enc_name'],
-                'enc_time': encounter_info['enc_time'],
-                'enc_kill': encounter_info['enc_kill'],
-                'computed': datetime.now().isoformat(),
-            }
-            report = {
-                'report_id': report_id,
-                'fight_id': fight_id,
-                'results': results,
-                'actors': actors,
-                'enc_name': encounter_info['enc_name'],
-                'enc_time': encounter_info['enc_time'],
-                'enc_kill': encounter_info['enc_kill'],
-                'computed': datetime.now(),
-            }
-            row_result = client.insert_rows_json(Reports, [sql_report])
+            report = store_report(report_id, fight_id, results, actors,
+                                  encounter_info, not is_fight_current(report_id, fight_id))
 
     report['results'] = {int(k): v for k, v in report['results'].items()}
     report['actors'] = {int(k): v for k, v in report['actors'].items()}
@@ -194,3 +218,72 @@ ORDER BY computed DESC;
         sorted(report['results'].items())).values())
     actors = {int(k): v for k, v in report['actors'].items()}
     return render_template('calc.html', report=report)
+
+
+# reports whose fights are currently being computed by calc_report_job and
+# the error which stopped the last job for a report, if it failed
+running_reports = set()
+failed_reports = {}
+running_lock = Lock()
+
+
+def calc_report_job(report_id, stored, current):
+    """Computes and saves every fight in a report which hasn't been computed
+    since LAST_CALC_DATE, only fights which weren't stored before count
+    towards the report count"""
+    new_fights = 0
+    try:
+        for fight_id, (results, actors, encounter_info) in iter_cardcalc_report(report_id, tokens.get(), skip=current):
+            if is_fight_current(report_id, fight_id):
+                continue
+            store_report(report_id, fight_id, results, actors, encounter_info)
+            if fight_id not in stored:
+                new_fights += 1
+    except Exception as exception:
+        app.logger.exception('Computing report %s failed', report_id)
+        if not isinstance(exception, CardCalcException):
+            exception = CardCalcException(
+                "Computing the report failed, try again later")
+        with running_lock:
+            failed_reports[report_id] = exception
+    finally:
+        if new_fights > 0:
+            increment_count(new_fights)
+        with running_lock:
+            running_reports.discard(report_id)
+
+
+@app.route('/<string:report_id>/all')
+def calc_all(report_id):
+    """Starts computing every fight in a report in the background and lists
+    the fights, or shows the first fight if they're all computed already"""
+    if (len(report_id) < 14 or len(report_id) > 24):
+        return redirect(url_for('homepage'))
+
+    try:
+        fights = get_report_fights(report_id, tokens.get())
+        if not fights:
+            raise CardCalcException("No fights found in report")
+    except CardCalcException as exception:
+        return render_template('error.html', exception=exception)
+
+    stored, current = get_stored_fights(report_id)
+    if all(f.index in current for f in fights):
+        return redirect(url_for('calc',
+                                report_id=report_id,
+                                fight_id=min(current)))
+
+    # a report can take longer than a request is allowed to so it's
+    # computed in the background, one job per report at a time. If the last
+    # job failed its error is shown once and the next visit tries again
+    with running_lock:
+        exception = failed_reports.pop(report_id, None)
+        if exception is None and report_id not in running_reports:
+            running_reports.add(report_id)
+            Thread(target=calc_report_job, args=(
+                report_id, stored, current), daemon=True).start()
+    if exception is not None:
+        return render_template('error.html', exception=exception)
+
+    return render_template('report.html', report_id=report_id,
+                           fights=sorted(fights, key=lambda f: f.index), current=current)
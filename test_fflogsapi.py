@@ -0,0 +1,90 @@
+import os
+import time
+
+import pytest
+
+os.environ.setdefault('FFLOGS_CLIENT_ID', 'test')
+os.environ.setdefault('FFLOGS_CLIENT_SECRET', 'test')
+
+import cardcalc_fflogsapi  # noqa: E402
+from cardcalc_data import CardCalcException  # noqa: E402
+
+REPORT = 'abcdefabcdefabcd'
+
+
+def _fight(fight_id):
+    return {'id': fight_id, 'startTime': 1000 * fight_id, 'endTime': 1000 * fight_id + 500, 'name': 'Boss', 'kill': True}
+
+
+@pytest.fixture
+def live_report(monkeypatch):
+    report = {'endTime': None, 'fights': [_fight(1)], 'masterData': {'pets': []}}
+    requests = []
+
+    def query_report(report_id, fields, token, *args):
+        requests.append(report_id)
+        return {**report, 'fights': list(report['fights'])}
+
+    monkeypatch.setattr(cardcalc_fflogsapi, '_query_report', query_report)
+    cardcalc_fflogsapi.metadata_cache.clear()
+    yield report, requests
+    cardcalc_fflogsapi.metadata_cache.clear()
+
+
+def test_fight_added_after_metadata_cached(live_report):
+    (report, requests) = live_report
+
+    assert cardcalc_fflogsapi.get_fight_info(REPORT, 1, None).index == 1
+    report['fights'].append(_fight(2))
+
+    assert cardcalc_fflogsapi.get_fight_info(REPORT, 2, None).index == 2
+    assert len(requests) == 2
+
+
+def test_missing_fight_refetched_once(live_report):
+    (_, requests) = live_report
+
+    cardcalc_fflogsapi.get_report_metadata(REPORT, None)
+    with pytest.raises(CardCalcException):
+        cardcalc_fflogsapi.get_fight_info(REPORT, 3, None)
+    assert len(requests) == 2
+
+
+def test_last_fight_of_live_report_refetched(live_report):
+    (report, requests) = live_report
+
+    assert cardcalc_fflogsapi.get_last_fight(REPORT, None) == 1
+    report['fights'].append(_fight(2))
+
+    assert cardcalc_fflogsapi.get_last_fight(REPORT, None) == 2
+    assert len(requests) == 2
+
+
+def test_last_fight_of_finished_report_cached(live_report):
+    (report, requests) = live_report
+    report['endTime'] = 1000 * (time.time() - 2 * cardcalc_fflogsapi.LIVE_REPORT_WINDOW)
+
+    cardcalc_fflogsapi.get_last_fight(REPORT, None)
+    cardcalc_fflogsapi.get_last_fight(REPORT, None)
+    assert len(requests) == 1
+
+
+def test_fight_data_for_fight_added_after_metadata_cached(live_report, monkeypatch):
+    (report, requests) = live_report
+    monkeypatch.setattr(cardcalc_fflogsapi, '_query_report_async', _no_events)
+
+    cardcalc_fflogsapi.get_report_metadata(REPORT, None)
+    report['fights'].append(_fight(2))
+
+    with pytest.raises(_Fetched) as fetched:
+        cardcalc_fflogsapi.get_fight_data(REPORT, 2, None)
+    assert fetched.value.args[0] == (REPORT, 2)
+    assert len(requests) == 2
+
+
+class _Fetched(Exception):
+    pass
+
+
+async def _no_events(report, fields, token, semaphore=None, fight=None, columns=()):
+    raise _Fetched((report, fight))
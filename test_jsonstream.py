@@ -0,0 +1,45 @@
+import json
+
+from cardcalc_jsonstream import parse_chunks
+
+DOCUMENT = json.dumps({
+    'data': {
+        'report': {
+            'events': {
+                'data': [
+                    {'timestamp': 1234, 'amount': 12.5, 'multiplier': 1.05e-3, 'hitType': 2},
+                    {'timestamp': 1300, 'amount': -7, 'tick': True, 'name': 'a "b" c'},
+                    {'timestamp': 1301, 'amount': 0.25, 'sourceID': None},
+                ],
+                'nextPageTimestamp': 1301.5,
+            },
+        },
+    },
+    'extra': [1.5e10, -0.0, False],
+})
+
+
+class ListCollector:
+    def __init__(self):
+        self.items = []
+
+    def append(self, item):
+        self.items.append(item)
+
+    def finish(self):
+        return self.items
+
+
+def test_every_split_offset():
+    expected = json.loads(DOCUMENT)
+    collectors = {('data', 'report', 'events', 'data'): ListCollector}
+
+    for offset in range(len(DOCUMENT) + 1):
+        chunks = [DOCUMENT[:offset], DOCUMENT[offset:]]
+        assert parse_chunks(chunks, collectors) == expected, offset
+
+
+def test_single_character_chunks():
+    collectors = {('data', 'report', 'events', 'data'): ListCollector}
+
+    assert parse_chunks(list(DOCUMENT), collectors) == json.loads(DOCUMENT)
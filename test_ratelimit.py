@@ -0,0 +1,39 @@
+import threading
+import time
+
+import pytest
+
+from cardcalc_data import CardCalcException
+from cardcalc_ratelimit import BATCH_PRIORITY, INTERACTIVE_PRIORITY, RateLimitScheduler
+
+SPENT_BUDGET = {'limitPerHour': 100, 'pointsSpentThisHour': 100, 'pointsResetIn': 3600}
+
+
+def test_interactive_request_gives_up_on_spent_budget():
+    scheduler = RateLimitScheduler(max_interactive_wait=0.1)
+    scheduler.update(SPENT_BUDGET, 0)
+
+    start = time.monotonic()
+    with pytest.raises(CardCalcException, match='60 minutes'):
+        with scheduler.reserve(1, INTERACTIVE_PRIORITY):
+            pass
+    assert time.monotonic() - start < 1
+    assert scheduler._waiting == []
+
+
+def test_batch_request_keeps_waiting():
+    scheduler = RateLimitScheduler(max_interactive_wait=0.1)
+    scheduler.update(SPENT_BUDGET, 0)
+    reserved = threading.Event()
+
+    def reserve():
+        with scheduler.reserve(1, BATCH_PRIORITY):
+            reserved.set()
+
+    thread = threading.Thread(target=reserve, daemon=True)
+    thread.start()
+    assert not reserved.wait(0.3)
+
+    scheduler.update({**SPENT_BUDGET, 'pointsSpentThisHour': 0}, 0)
+    assert reserved.wait(1)
+    thread.join()